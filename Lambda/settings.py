@@ -123,3 +123,72 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Textract job polling, see myapi/polling.py
+# The first status check happens after `firstDelay` seconds, later checks back off from `interval`
+# by `factor` up to `maxInterval`, each delay is randomised by +/- `jitter` and the whole wait is
+# bounded by `deadline` seconds.
+
+TEXTRACT_POLLING = {
+    'firstDelay': 1.0,
+    'interval': 1.0,
+    'factor': 1.5,
+    'maxInterval': 10.0,
+    'jitter': 0.1,
+    'deadline': 900.0,
+}
+
+
+# Shared botocore client settings, see myapi/clients.py
+
+AWS_CLIENT_CONFIG = {
+    'max_pool_connections': 50,
+    'tcp_keepalive': True,
+    'retries': {'mode': 'standard', 'max_attempts': 5},
+}
+
+
+# Raw Textract results keyed by S3 object identity, see myapi/cache.py
+# Set to None to always run a new Textract job.
+
+TEXTRACT_RESULT_CACHE = {
+    'directory': os.path.join(BASE_DIR, 'textract_cache'),
+    'maxBytes': 512 * 1024 * 1024,
+    'ttl': 7 * 24 * 3600,
+    'compressLevel': 1,
+}
+
+
+# Number of compiled inputFormat matchers kept in memory per process, see myapi/formats.py
+
+TEXTRACT_FORMAT_CACHE_SIZE = 256
+
+
+# Minimum trigram similarity (0-1) for approximate key and header matches, see myapi/matching.py
+# An inputFormat can override it with a "matchThreshold" entry, 1 disables approximate matching.
+
+TEXTRACT_MATCH_THRESHOLD = 0.75
+
+
+# Documents of one /batch/ request processed at the same time, see myapi/batch.py
+# Keep it at or below the account's concurrent Textract job quota.
+
+TEXTRACT_BATCH_CONCURRENCY = 8
+
+
+# Where Textract and S3 calls go, see myapi/backends.py: 'aws' for the live services, 'local' for
+# the offline stand-in, or the dotted path of a client factory(serviceName).
+
+TEXTRACT_BACKEND = 'aws'
+
+# Options of the 'local' backend. Documents are served from <recordings>/<name>.json when it exists
+# and are generated with myapi.synthetic.SyntheticDocument(**synthetic) otherwise. Jobs stay
+# IN_PROGRESS for `latency` seconds and a `throttleRate` share of calls fail with ThrottlingException.
+
+TEXTRACT_LOCAL_BACKEND = {
+    'recordings': os.path.join(BASE_DIR, 'recordings'),
+    'synthetic': {'pages': 3},
+    'latency': 2.0,
+    'throttleRate': 0.0,
+}
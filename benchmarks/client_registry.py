@@ -0,0 +1,80 @@
+# Compares building a fresh Textract client per call (what startJob, isJobComplete and
+# getJobResults used to do) with the shared clients from myapi.clients.
+#
+#   python benchmarks/client_registry.py [--requests N] [--job-id JOB_ID]
+#
+# Without --job-id only client construction is timed (credential resolution, endpoint and
+# service model loading), which needs no network. With --job-id every iteration also makes
+# the three get_document_analysis calls a request makes, so connection setup and TLS
+# handshakes are included as well.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Lambda.settings')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import django
+django.setup()
+
+import boto3
+
+from myapi.clients import getClient, resetClients
+
+CALLS_PER_REQUEST = 3
+
+
+def freshClient():
+    return boto3.client('textract')
+
+
+def sharedClient():
+    return getClient('textract')
+
+
+def run(makeClient, requests, jobId):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        for _ in range(CALLS_PER_REQUEST):
+            client = makeClient()
+            if(jobId):
+                client.get_document_analysis(JobId=jobId, MaxResults=1)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings
+
+
+def report(name, timings):
+    mean = sum(timings) / len(timings)
+    p50 = timings[len(timings) // 2]
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print("{:<8} mean {:8.2f} ms   p50 {:8.2f} ms   p95 {:8.2f} ms".format(
+        name, mean * 1000, p50 * 1000, p95 * 1000))
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--job-id', default=None)
+    args = parser.parse_args()
+
+    if(not args.job_id):
+        # Client construction resolves credentials but never uses them
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+    resetClients()
+    # The shared client is built once per process, outside of any request
+    sharedClient()
+    fresh = report('fresh', run(freshClient, args.requests, args.job_id))
+    shared = report('shared', run(sharedClient, args.requests, args.job_id))
+    print("saved per request: {:.2f} ms".format((fresh - shared) * 1000))
+
+
+if __name__ == '__main__':
+    main()
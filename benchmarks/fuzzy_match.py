@@ -0,0 +1,54 @@
+# FuzzyIndex lookups of OCR-garbled line texts against every line of a synthetic document.
+#
+#   python benchmarks/fuzzy_match.py [--pages 100] [--lookups 1000] [--typos 2] [--threshold 0.75]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from myapi.matching import FuzzyIndex
+from myapi.synthetic import SyntheticDocument
+
+
+def garble(text, typos, rnd):
+    chars = list(text)
+    for _ in range(typos):
+        chars[rnd.randrange(len(chars))] = rnd.choice('abcdefghijklmnopqrstuvwxyz')
+    return ''.join(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--typos', type=int, default=2)
+    parser.add_argument('--threshold', type=float, default=0.75)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    lines = [block['Text'] for block in SyntheticDocument(args.pages, seed=args.seed).blocks()
+             if block['BlockType'] == 'LINE']
+    rnd = random.Random(args.seed)
+    queries = [garble(rnd.choice(lines), args.typos, rnd) for _ in range(args.lookups)]
+
+    start = time.perf_counter()
+    index = FuzzyIndex()
+    for i, line in enumerate(lines):
+        index.add(line, i)
+    built = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = sum(1 for query in queries if index.lookup(query, args.threshold) is not None)
+    elapsed = time.perf_counter() - start
+
+    print("{} lines, index built in {:.1f} ms".format(len(lines), built * 1000))
+    print("{} lookups in {:.1f} ms ({:.1f} us each), {} matched".format(
+        len(queries), elapsed * 1000, elapsed * 1e6 / len(queries), found))
+
+
+if __name__ == '__main__':
+    main()
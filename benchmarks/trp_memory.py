@@ -0,0 +1,63 @@
+# Memory used by the object graph trp.Document builds, in bytes per Textract block.
+#
+#   python benchmarks/trp_memory.py [--pages N] [--baseline path/to/old/trp.py]
+#
+# --baseline loads another version of trp.py (for example one exported with
+# `git show <rev>:myapi/trp.py > /tmp/trp_old.py`) and reports both side by side.
+
+import argparse
+import gc
+import importlib.util
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from myapi import trp
+from myapi.synthetic import SyntheticDocument
+
+
+def loadModule(path):
+    spec = importlib.util.spec_from_file_location("trp_baseline", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(module, responsePages):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    doc = module.Document(responsePages)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del doc
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=60)
+    parser.add_argument('--words', type=int, default=8)
+    parser.add_argument('--baseline', default=None)
+    args = parser.parse_args()
+
+    responsePages = SyntheticDocument(args.pages, args.lines, args.words).responsePages()
+    blocks = sum(len(r["Blocks"]) for r in responsePages)
+    print("{} pages, {} blocks".format(args.pages, blocks))
+
+    results = [("current", measure(trp, responsePages))]
+    if(args.baseline):
+        results.insert(0, ("baseline", measure(loadModule(args.baseline), responsePages)))
+
+    for name, used in results:
+        print("{:<10} {:10.1f} KiB   {:8.1f} bytes/block".format(name, used / 1024.0, used / float(blocks)))
+    if(len(results) == 2):
+        print("saved: {:.1f}%".format(100.0 * (1 - results[1][1] / float(results[0][1]))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# Parse time, peak memory and live objects per class of trp.Document across document sizes.
+#
+#   python benchmarks/trp_parse.py [--pages 1,10,50] [--kvs 20] [--tables 2] [--save results.json]
+#                                  [--compare results.json]
+#
+# Documents come from myapi.synthetic.SyntheticDocument. --save writes the results as JSON and
+# --compare prints the change against a file written earlier, e.g. on the previous commit:
+#
+#   git stash && python benchmarks/trp_parse.py --save /tmp/before.json && git stash pop
+#   python benchmarks/trp_parse.py --compare /tmp/before.json
+
+import argparse
+import collections
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from myapi import trp
+from myapi.synthetic import SyntheticDocument
+
+
+def parseTime(responsePages, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        trp.Document(responsePages)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peakMemory(responsePages):
+    gc.collect()
+    tracemalloc.start()
+    doc = trp.Document(responsePages)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del doc
+    return peak
+
+
+def objectCounts(responsePages):
+    gc.collect()
+    doc = trp.Document(responsePages)
+    counts = collections.Counter(
+        type(o).__name__ for o in gc.get_objects() if type(o).__module__ == trp.__name__)
+    del doc
+    return dict(counts)
+
+
+def run(args):
+    results = []
+    for pages in args.pages:
+        document = SyntheticDocument(
+            pages, args.lines, args.words, keyValuesPerPage=args.kvs, tablesPerPage=args.tables,
+            tableRows=args.rows, tableColumns=args.columns, spanRate=args.spans,
+            selectionRate=args.selections)
+        responsePages = document.responsePages()
+        results.append({
+            "pages": pages,
+            "blocks": sum(len(r["Blocks"]) for r in responsePages),
+            "seconds": parseTime(responsePages, args.repeat),
+            "peakBytes": peakMemory(responsePages),
+            "objects": objectCounts(responsePages),
+        })
+    return results
+
+
+def change(current, baseline):
+    if(not baseline):
+        return ""
+    return "{:+.1f}%".format(100.0 * (current - baseline) / baseline)
+
+
+def report(results, baseline):
+    previous = dict((b["pages"], b) for b in baseline or [])
+    for result in results:
+        old = previous.get(result["pages"], {})
+        print("{} pages, {} blocks".format(result["pages"], result["blocks"]))
+        print("  parse {:10.1f} ms   {:>8}".format(
+            result["seconds"] * 1000, change(result["seconds"], old.get("seconds"))))
+        print("  peak  {:10.1f} KiB  {:>8}".format(
+            result["peakBytes"] / 1024.0, change(result["peakBytes"], old.get("peakBytes"))))
+        oldObjects = old.get("objects", {})
+        for name in sorted(set(result["objects"]) | set(oldObjects)):
+            count = result["objects"].get(name, 0)
+            print("  {:<18} {:8d}   {:>8}".format(name, count, change(count, oldObjects.get(name))))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=lambda s: [int(p) for p in s.split(',')], default=[1, 10, 50])
+    parser.add_argument('--lines', type=int, default=40)
+    parser.add_argument('--words', type=int, default=6)
+    parser.add_argument('--kvs', type=int, default=20)
+    parser.add_argument('--tables', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=15)
+    parser.add_argument('--columns', type=int, default=5)
+    parser.add_argument('--spans', type=float, default=0.05)
+    parser.add_argument('--selections', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', default=None)
+    parser.add_argument('--compare', default=None)
+    args = parser.parse_args()
+
+    baseline = None
+    if(args.compare):
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = run(args)
+    report(results, baseline)
+
+    if(args.save):
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
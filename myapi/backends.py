@@ -0,0 +1,211 @@
+import collections
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+import zlib
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .synthetic import SyntheticDocument
+
+MAX_RESULTS = 1000
+LOCAL_DOCUMENT_CACHE_SIZE = 8
+
+
+def getClientConfig():
+    return Config(**getattr(settings, 'AWS_CLIENT_CONFIG', {}))
+
+
+def createAwsClient(serviceName):
+    # boto3's default session is not thread-safe, build the client from a private one
+    session = boto3.session.Session()
+    return session.client(serviceName, config=getClientConfig())
+
+
+def getMaxAttempts():
+    # The attempts botocore makes per call under AWS_CLIENT_CONFIG (3 is its own default)
+    return getattr(settings, 'AWS_CLIENT_CONFIG', {}).get('retries', {}).get('max_attempts', 3)
+
+
+def getLocalOptions():
+    options = {
+        'recordings': None,
+        'synthetic': {},
+        'latency': 0.0,
+        'throttleRate': 0.0,
+        'seed': None,
+    }
+    options.update(getattr(settings, 'TEXTRACT_LOCAL_BACKEND', {}))
+    return options
+
+
+class LocalDocuments:
+    # Block lists of the documents the stand-in serves: a recording <recordings>/<name>.json
+    # (one response, or a list of NextToken pages as saved from the live API) when there is
+    # one, otherwise a SyntheticDocument seeded from the object name
+    def __init__(self, recordings=None, synthetic=None):
+        self._recordings = recordings
+        self._synthetic = synthetic or {}
+        self._documents = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recordingPath(self, objectName):
+        if(not self._recordings):
+            return None
+        path = os.path.join(self._recordings, objectName + '.json')
+        return path if os.path.isfile(path) else None
+
+    def _load(self, objectName):
+        path = self._recordingPath(objectName)
+        if(path is None):
+            options = dict(self._synthetic)
+            options.setdefault('seed', zlib.crc32(objectName.encode('utf-8')))
+            return list(SyntheticDocument(**options).blocks())
+
+        with open(path) as f:
+            recorded = json.load(f)
+        if(isinstance(recorded, dict)):
+            recorded = [recorded]
+        blocks = []
+        for response in recorded:
+            blocks.extend(response.get('Blocks', []))
+        return blocks
+
+    def get(self, objectName):
+        with self._lock:
+            blocks = self._documents.get(objectName)
+            if(blocks is not None):
+                self._documents.move_to_end(objectName)
+                return blocks
+        blocks = self._load(objectName)
+        with self._lock:
+            self._documents[objectName] = blocks
+            while(len(self._documents) > LOCAL_DOCUMENT_CACHE_SIZE):
+                self._documents.popitem(last=False)
+        return blocks
+
+    def getETag(self, objectName):
+        path = self._recordingPath(objectName)
+        if(path is None):
+            identity = json.dumps([objectName, self._synthetic], sort_keys=True).encode('utf-8')
+        else:
+            with open(path, 'rb') as f:
+                identity = f.read()
+        return '"{}"'.format(hashlib.md5(identity).hexdigest())
+
+
+class LocalClient:
+    def __init__(self, documents, throttleRate=0.0, seed=None):
+        self._documents = documents
+        self._throttleRate = throttleRate
+        self._maxAttempts = max(getMaxAttempts(), 1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _error(self, operationName, code, message):
+        return ClientError({'Error': {'Code': code, 'Message': message}}, operationName)
+
+    def _throttle(self, operationName):
+        # Throttled attempts are retried the way botocore's standard retry mode would (with its
+        # jittered exponential backoff) and only the last one surfaces as a ClientError
+        for attempt in range(self._maxAttempts):
+            with self._lock:
+                throttled = self._random.random() < self._throttleRate
+                backoff = self._random.uniform(0, min(2 ** attempt, 20))
+            if(not throttled):
+                return
+            if(attempt + 1 < self._maxAttempts):
+                time.sleep(backoff)
+        raise self._error(operationName, 'ThrottlingException', 'Rate exceeded')
+
+
+class LocalTextractClient(LocalClient):
+    # Serves start_document_analysis/get_document_analysis like the live API: a job stays
+    # IN_PROGRESS for `latency` seconds, then its blocks are returned MaxResults at a time
+    # chained by NextToken
+    def __init__(self, documents, latency=0.0, throttleRate=0.0, seed=None):
+        super().__init__(documents, throttleRate, seed)
+        self._latency = latency
+        self._jobs = {}
+
+    def start_document_analysis(self, DocumentLocation, FeatureTypes, **kwargs):
+        self._throttle('StartDocumentAnalysis')
+        jobId = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[jobId] = (DocumentLocation['S3Object']['Name'], time.time())
+        return {'JobId': jobId}
+
+    def get_document_analysis(self, JobId, MaxResults=MAX_RESULTS, NextToken=None):
+        self._throttle('GetDocumentAnalysis')
+        with self._lock:
+            job = self._jobs.get(JobId)
+        if(job is None):
+            raise self._error('GetDocumentAnalysis', 'InvalidJobIdException', 'Unknown job {}'.format(JobId))
+
+        objectName, started = job
+        if(time.time() - started < self._latency):
+            return {'JobStatus': 'IN_PROGRESS'}
+
+        blocks = self._documents.get(objectName)
+        start = int(NextToken or 0)
+        end = start + min(MaxResults, MAX_RESULTS)
+        response = {
+            'DocumentMetadata': {'Pages': sum(1 for block in blocks if block['BlockType'] == 'PAGE')},
+            'JobStatus': 'SUCCEEDED',
+            'Blocks': blocks[start:end],
+        }
+        if(end < len(blocks)):
+            response['NextToken'] = str(end)
+        return response
+
+
+class LocalS3Client(LocalClient):
+    def head_object(self, Bucket, Key, **kwargs):
+        self._throttle('HeadObject')
+        return {'ETag': self._documents.getETag(Key)}
+
+
+_localDocuments = None
+_localDocumentsLock = threading.Lock()
+
+
+def getLocalDocuments():
+    global _localDocuments
+    if(_localDocuments is None):
+        with _localDocumentsLock:
+            if(_localDocuments is None):
+                options = getLocalOptions()
+                _localDocuments = LocalDocuments(options['recordings'], options['synthetic'])
+    return _localDocuments
+
+
+def createLocalClient(serviceName):
+    options = getLocalOptions()
+    if(serviceName == 'textract'):
+        return LocalTextractClient(getLocalDocuments(), options['latency'], options['throttleRate'], options['seed'])
+    if(serviceName == 's3'):
+        return LocalS3Client(getLocalDocuments(), options['throttleRate'], options['seed'])
+    raise ValueError("The local backend has no {} client".format(serviceName))
+
+
+BACKENDS = {
+    'aws': createAwsClient,
+    'local': createLocalClient,
+}
+
+
+def createClient(serviceName):
+    # TEXTRACT_BACKEND names a built-in backend or the dotted path of a factory(serviceName)
+    backend = getattr(settings, 'TEXTRACT_BACKEND', 'aws')
+    factory = BACKENDS.get(backend)
+    if(factory is None):
+        factory = import_string(backend)
+    return factory(serviceName)
@@ -0,0 +1,41 @@
+import itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+
+def getBatchConcurrency(requested=None):
+    # Raises ValueError unless `requested` is empty or a positive integer
+    limit = getattr(settings, 'TEXTRACT_BATCH_CONCURRENCY', 8)
+    if(requested is None):
+        return limit
+    if(isinstance(requested, bool) or not isinstance(requested, (int, str))
+            or not str(requested).isdigit() or int(requested) < 1):
+        raise ValueError("concurrency must be a positive integer")
+    return min(int(requested), limit)
+
+
+def iterBatch(func, items, concurrency=None):
+    # Yields (index, func(item)) in completion order. At most `concurrency` items are in flight;
+    # a new one is started as soon as one finishes, before its result is handed back.
+    concurrency = getBatchConcurrency(concurrency)
+    items = enumerate(items)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = {}
+    try:
+        for index, item in itertools.islice(items, concurrency):
+            pending[executor.submit(func, item)] = index
+
+        while(pending):
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                for nextIndex, item in itertools.islice(items, 1):
+                    pending[executor.submit(func, item)] = nextIndex
+                yield index, future.result()
+    finally:
+        # The consumer went away (e.g. the client closed a streamed response): drop what has
+        # not started yet, the running jobs finish in the background
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
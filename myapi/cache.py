@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+
+from .clients import getClient
+
+CACHE_SUFFIX = '.json.gz'
+MAX_PENDING_WRITES = 4
+
+
+class ResultCache:
+    def __init__(self, directory, maxBytes=512 * 1024 * 1024, ttl=7 * 24 * 3600, compressLevel=1):
+        self._directory = directory
+        self._maxBytes = maxBytes
+        self._ttl = ttl
+        self._compressLevel = compressLevel
+        self._lock = threading.Lock()
+        # One writer thread, so writes never run on a request thread and never race each other
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='result-cache')
+        self._pendingWrites = threading.BoundedSemaphore(MAX_PENDING_WRITES)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            modified = os.path.getmtime(path)
+            if(time.time() - modified > self._ttl):
+                os.remove(path)
+                return None
+            with gzip.open(path, 'rt') as f:
+                pages = json.load(f)
+        except (OSError, ValueError):
+            # Missing, evicted by another worker or truncated: all of them are a miss
+            return None
+
+        # Record the access in the atime (the mtime stays the write time the TTL is measured
+        # from) so eviction drops the least recently used entries first
+        try:
+            os.utime(path, (time.time(), modified))
+        except OSError:
+            pass
+        return pages
+
+    def set(self, key, pages):
+        # Serialized and compressed in one go, json.dump into a gzip stream is several times slower
+        data = gzip.compress(json.dumps(pages, separators=(',', ':')).encode('utf-8'), self._compressLevel)
+        fd, tmpPath = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmpPath, self._path(key))
+        except BaseException:
+            os.remove(tmpPath)
+            raise
+        self._evict()
+
+    def setInBackground(self, key, pages):
+        # Queues set() on the writer thread. The cache is best effort: while MAX_PENDING_WRITES
+        # results are waiting to be written, further ones are dropped rather than held in memory.
+        if(not self._pendingWrites.acquire(blocking=False)):
+            print("WARNING: Result cache writes are backed up, {} not cached".format(key))
+            return None
+        return self._writer.submit(self._write, key, pages)
+
+    def _write(self, key, pages):
+        try:
+            self.set(key, pages)
+        except Exception as e:
+            print("WARNING: Could not write result cache entry {}: {}".format(key, e))
+        finally:
+            self._pendingWrites.release()
+
+    def flush(self):
+        # Waits until the writes queued so far are on disk
+        self._writer.submit(lambda: None).result()
+
+    def _evict(self):
+        with self._lock:
+            now = time.time()
+            entries = []
+            total = 0
+            with os.scandir(self._directory) as it:
+                for entry in it:
+                    if(not entry.name.endswith(CACHE_SUFFIX)):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if(now - stat.st_mtime > self._ttl):
+                        self._remove(entry.path)
+                        continue
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if(total <= self._maxBytes):
+                    break
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def getObjectCacheKey(s3BucketName, objectName):
+    # The ETag (and version, on versioned buckets) changes whenever the object is overwritten,
+    # so a key built from them never serves results of an older upload
+    try:
+        head = getClient('s3').head_object(Bucket=s3BucketName, Key=objectName)
+    except (BotoCoreError, ClientError) as e:
+        print("WARNING: Could not read S3 object identity, result cache bypassed: {}".format(e))
+        return None
+
+    identity = [s3BucketName, objectName, head.get('ETag', ''), head.get('VersionId', '')]
+    return hashlib.sha256('\0'.join(identity).encode('utf-8')).hexdigest()
+
+
+_resultCache = None
+_resultCacheLock = threading.Lock()
+
+
+def getResultCache():
+    global _resultCache
+    options = getattr(settings, 'TEXTRACT_RESULT_CACHE', None)
+    if(not options):
+        return None
+    if(_resultCache is None):
+        with _resultCacheLock:
+            if(_resultCache is None):
+                _resultCache = ResultCache(**options)
+    return _resultCache
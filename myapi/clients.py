@@ -0,0 +1,24 @@
+import threading
+
+from .backends import createClient
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def getClient(serviceName):
+    # botocore clients are thread-safe once created, so every request thread shares one client
+    # (and its connection pool) per service for the lifetime of the process
+    client = _clients.get(serviceName)
+    if(client is None):
+        with _lock:
+            client = _clients.get(serviceName)
+            if(client is None):
+                client = createClient(serviceName)
+                _clients[serviceName] = client
+    return client
+
+
+def resetClients():
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .matching import FuzzyIndex, getMatchThreshold, normalizeText
+from .models import InputFormatTemplate
+
+
+def getContentHash(inputFormat):
+    content = json.dumps(inputFormat, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class CompiledFormat:
+    def __init__(self, inputFormat, contentHash=None):
+        self._inputFormat = inputFormat
+        self._contentHash = contentHash or getContentHash(inputFormat)
+        self._first = self._compileGroups(inputFormat["input_first"])
+        self._second = self._compileGroups(inputFormat["input_second"])
+        self._threshold = inputFormat.get("matchThreshold", getMatchThreshold())
+
+        # Header cell text -> input_second group. Groups are walked in order and aliases in
+        # priority order, so the first group that lists a header keeps it
+        self._headerLookup = {}
+        self._headerIndex = FuzzyIndex()
+        for index, (names, _) in enumerate(self._second):
+            for name in names:
+                self._headerLookup.setdefault(name, index)
+                self._headerIndex.add(name, index)
+
+    def _compileGroups(self, groups):
+        compiled = []
+        for aliases in groups:
+            names = []
+            for alias in aliases:
+                name = normalizeText(alias)
+                if(name not in names):
+                    names.append(name)
+            compiled.append((tuple(names), aliases[0]))
+        return compiled
+
+    def matchFirst(self, matcher):
+        return [matcher.matchNormalized(names, fallback) for names, fallback in self._first]
+
+    def matchSecond(self, matcher):
+        return [matcher.matchNormalized(names, fallback) for names, fallback in self._second]
+
+    def getHeaderGroup(self, text):
+        group = self._headerLookup.get(normalizeText(text))
+        if(group is None and self._threshold < 1):
+            group = self._headerIndex.lookup(text, self._threshold)
+        return group
+
+    @property
+    def inputFormat(self):
+        return self._inputFormat
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    @property
+    def contentHash(self):
+        return self._contentHash
+
+
+class TemplateNotFound(Exception):
+    pass
+
+
+class InvalidFormat(ValueError):
+    pass
+
+
+def validateFormat(inputFormat):
+    if(not isinstance(inputFormat, dict)):
+        raise InvalidFormat("inputFormat must be an object")
+    for key in ("input_first", "input_second"):
+        groups = inputFormat.get(key)
+        if(not isinstance(groups, list)):
+            raise InvalidFormat("inputFormat.{} must be a list of alias lists".format(key))
+        for aliases in groups:
+            if(not isinstance(aliases, list) or not aliases or not all(isinstance(a, str) for a in aliases)):
+                raise InvalidFormat("inputFormat.{} entries must be non-empty lists of strings".format(key))
+    threshold = inputFormat.get("matchThreshold")
+    if(threshold is not None and (isinstance(threshold, bool) or not isinstance(threshold, (int, float))
+                                  or not 0 <= threshold <= 1)):
+        raise InvalidFormat("inputFormat.matchThreshold must be a number between 0 and 1")
+
+
+class CompiledFormatCache:
+    def __init__(self, maxSize=256):
+        self._maxSize = maxSize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            compiled = self._entries.get(key)
+            if(compiled is not None):
+                self._entries.move_to_end(key)
+            return compiled
+
+    def set(self, key, compiled):
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while(len(self._entries) > self._maxSize):
+                self._entries.popitem(last=False)
+
+
+_compiledFormats = CompiledFormatCache(getattr(settings, 'TEXTRACT_FORMAT_CACHE_SIZE', 256))
+
+
+def compileFormat(inputFormat):
+    validateFormat(inputFormat)
+    contentHash = getContentHash(inputFormat)
+    compiled = _compiledFormats.get(contentHash)
+    if(compiled is None):
+        compiled = CompiledFormat(inputFormat, contentHash)
+        _compiledFormats.set(contentHash, compiled)
+    return compiled
+
+
+def getTemplate(templateRef):
+    templates = InputFormatTemplate.objects.all()
+    try:
+        if(str(templateRef).isdigit()):
+            return templates.get(pk=int(templateRef))
+        return templates.get(content_hash=templateRef)
+    except InputFormatTemplate.DoesNotExist:
+        raise TemplateNotFound(templateRef)
+
+
+def getTemplateFormat(templateRef):
+    # Templates never change once registered, so a reference can stay cached for good
+    cacheKey = "template:{}".format(templateRef)
+    compiled = _compiledFormats.get(cacheKey)
+    if(compiled is not None):
+        return compiled
+
+    template = getTemplate(templateRef)
+    compiled = compileFormat(json.loads(template.input_format))
+    _compiledFormats.set(cacheKey, compiled)
+    return compiled
+
+
+def getRequestFormat(paramObject):
+    if('template' in paramObject):
+        return getTemplateFormat(paramObject['template'])
+    if('inputFormat' not in paramObject):
+        raise InvalidFormat("Request needs an inputFormat or a template")
+    return compileFormat(paramObject['inputFormat'])
+
+
+def registerTemplate(inputFormat, name=''):
+    compiled = compileFormat(inputFormat)
+    template, _ = InputFormatTemplate.objects.get_or_create(
+        content_hash=compiled.contentHash,
+        defaults={'name': name, 'input_format': json.dumps(inputFormat)})
+    return template
@@ -0,0 +1,100 @@
+import collections
+import contextlib
+import threading
+import time
+
+_local = threading.local()
+
+
+class Timings:
+    # Wall time per pipeline stage and counters for one request. Stages and counts may be
+    # recorded from several threads (the result page producer runs next to the request thread).
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._stages = collections.OrderedDict()
+        self._counts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self._stages[name] = self._stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def getStage(self, name):
+        return self._stages.get(name, 0.0)
+
+    def getCount(self, name):
+        return self._counts.get(name, 0)
+
+    @property
+    def total(self):
+        return time.perf_counter() - self._start
+
+    def serverTiming(self):
+        # Server-Timing header value: one metric per stage in milliseconds, counters as descriptions
+        with self._lock:
+            metrics = ['{};dur={:.1f}'.format(name, seconds * 1000) for name, seconds in self._stages.items()]
+            metrics += ['{};desc="{}"'.format(name, n) for name, n in self._counts.items()]
+        metrics.append('total;dur={:.1f}'.format(self.total * 1000))
+        return ', '.join(metrics)
+
+    def asDict(self):
+        with self._lock:
+            stages = collections.OrderedDict(
+                (name, round(seconds * 1000, 1)) for name, seconds in self._stages.items())
+            counts = collections.OrderedDict(self._counts)
+        return {'totalMs': round(self.total * 1000, 1), 'stagesMs': stages, 'counts': counts}
+
+
+class NullTimings(Timings):
+    # Used outside collectTimings() so instrumented code never has to check for it
+    def add(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_TIMINGS = NullTimings()
+
+
+def getTimings():
+    return getattr(_local, 'timings', NULL_TIMINGS)
+
+
+@contextlib.contextmanager
+def collectTimings(timings=None):
+    # Makes `timings` (a new Timings by default) the current one of this thread
+    if(timings is None):
+        timings = Timings()
+    previous = getattr(_local, 'timings', NULL_TIMINGS)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def stage(name):
+    return getTimings().stage(name)
+
+
+def count(name, n=1):
+    getTimings().count(name, n)
+
+
+def isDebugRequest(request, paramObject=None):
+    if(request.GET.get('debug') in ('1', 'true')):
+        return True
+    return bool(paramObject and paramObject.get('debug'))
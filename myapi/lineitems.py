@@ -0,0 +1,71 @@
+def getTableSignature(table, compiledFormat):
+    # Header group -> column of the table's first row, the leftmost column wins on repeats
+    columns = {}
+    if(table.rowCount):
+        for c, cell in enumerate(table.grid[0]):
+            if(cell is None):
+                continue
+            group = compiledFormat.getHeaderGroup(cell.text)
+            if(group is not None):
+                columns.setdefault(group, c)
+    return columns
+
+
+def indexTables(doc, compiledFormat):
+    # One entry per table of the document, in page order: (pageNumber, positionOnPage, table, signature)
+    entries = []
+    for pageNumber, page in enumerate(doc.pages):
+        for position, table in enumerate(page.tables):
+            entries.append((pageNumber, position, table, getTableSignature(table, compiledFormat)))
+    return entries
+
+
+def findLineItemTables(doc, compiledFormat):
+    # Returns (table, columns, header, firstRow) entries. Tables whose header matches the most
+    # groups hold line items; a headerless table that opens the next page with the same column
+    # count continues the one before it and is read from its first row with the same columns.
+    entries = indexTables(doc, compiledFormat)
+    best = max([len(signature) for _, _, _, signature in entries] or [0])
+    if(best == 0):
+        return []
+
+    selected = []
+    previous = None
+    for pageNumber, position, table, signature in entries:
+        if(len(signature) == best):
+            selected.append((table, signature, table.grid[0], 1))
+            previous = (pageNumber, table, signature, table.grid[0])
+        elif(previous is not None and not signature and position == 0
+                and pageNumber == previous[0] + 1 and table.columnCount == previous[1].columnCount):
+            selected.append((table, previous[2], previous[3], 0))
+            previous = (pageNumber, table, previous[2], previous[3])
+    return selected
+
+
+def extractLineItems(doc, compiledFormat, groups):
+    # groups are the matched input_second entries; every row gets one {Name, Value, Confidence}
+    # per group, groups missing from the header come back empty with zero confidence
+    items = []
+    for table, columns, header, firstRow in findLineItemTables(doc, compiledFormat):
+        layout = []
+        for g, group in enumerate(groups):
+            column = columns.get(g)
+            name = group["Name"]
+            if(column is not None and header[column] is not None):
+                name = header[column].text.strip()
+            layout.append((name, column))
+
+        for row in table.grid[firstRow:]:
+            values = [cell.text.strip() if cell is not None else "" for cell in row]
+            if(not any(values)):
+                continue
+
+            subTable = []
+            for name, column in layout:
+                if(column is None or row[column] is None):
+                    subTable.append({"Name": name, "Value": "", "Confidence": 0})
+                else:
+                    subTable.append({"Name": name, "Value": values[column], "Confidence": row[column].confidence})
+            items.append(subTable)
+    return items
+
@@ -0,0 +1,225 @@
+import math
+from collections import defaultdict
+
+from django.conf import settings
+
+from .trp import normalizeKey
+
+
+def getChildIds(block):
+    for rs in block.get('Relationships') or []:
+        if(rs['Type'] == 'CHILD'):
+            return frozenset(rs['Ids'])
+    return None
+
+
+def buildKeyIndex(responsePages):
+    # Maps the set of WORD ids under each KEY block to that block, so a LINE made of
+    # exactly those words finds its key in O(1) instead of scanning every block
+    keyIndex = {}
+    for page in responsePages:
+        for block in page['Blocks']:
+            if(block['BlockType'] == 'KEY_VALUE_SET' and 'KEY' in block.get('EntityTypes', [])):
+                childIds = getChildIds(block)
+                if(childIds):
+                    keyIndex.setdefault(childIds, block)
+    return keyIndex
+
+
+def getFormValue(form, name):
+    # The first field on any page whose key matches and that has a value. Looking at the
+    # whole document keeps a later page without the key from blanking out an earlier match
+    for field in form.getFieldsByNormalizedKey(name):
+        if(field.value and field.value.text):
+            return str(field.value)
+    return ""
+
+
+def getLineConfidence(responsePages):
+    keyIndex = buildKeyIndex(responsePages)
+
+    arrOriginText = []
+    arrTextConf = []
+    for page in responsePages:
+        for block in page['Blocks']:
+            if(block['BlockType'] == 'LINE'):
+                arrOriginText.append(block['Text'].lower())
+                keyBlock = keyIndex.get(getChildIds(block))
+                if(keyBlock):
+                    arrTextConf.append(
+                        {"key_name": block["Text"], "key_conf": keyBlock["Confidence"]})
+    return arrOriginText, arrTextConf
+
+
+def normalizeText(text):
+    return text.strip().lower()
+
+
+def getMatchThreshold():
+    return getattr(settings, 'TEXTRACT_MATCH_THRESHOLD', 0.75)
+
+
+def normalizeFuzzyText(text):
+    # OCR noise is mostly stray punctuation and spacing, neither should count against a match
+    return normalizeKey(text)
+
+
+def getTrigrams(text):
+    padded = "  {} ".format(text)
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def addToCounts(counts, entries):
+    # counts are bit planes of a per-entry counter (plane i holds bit i of every entry's count),
+    # adding the bitset `entries` increments all of its entries at once
+    carry = entries
+    for i, plane in enumerate(counts):
+        if(not carry):
+            return
+        counts[i] = plane ^ carry
+        carry = plane & carry
+    if(carry):
+        counts.append(carry)
+
+
+def getAtLeast(counts, n):
+    # Bitset of the entries whose count in `counts` is n or more
+    if(n >= 1 << len(counts)):
+        return 0
+    greater = 0
+    equal = -1
+    for i in range(len(counts) - 1, -1, -1):
+        if(n >> i & 1):
+            equal &= counts[i]
+        else:
+            greater |= equal & counts[i]
+            equal &= ~counts[i]
+    return greater | equal
+
+
+class FuzzyIndex:
+    # Entries are bits: every trigram, and every trigram count, maps to an int with the bits of
+    # the entries having it set. A lookup counts shared trigrams for all entries at once with a
+    # few integer operations per query trigram, however many entries share a common trigram.
+    def __init__(self):
+        self._values = []
+        self._trigrams = []
+        self._exact = {}
+        self._postings = defaultdict(int)
+        self._sizes = defaultdict(int)
+
+    def add(self, text, value):
+        text = normalizeFuzzyText(text)
+        if(not text or text in self._exact):
+            return
+        entry = len(self._values)
+        trigrams = getTrigrams(text)
+        self._values.append(value)
+        self._trigrams.append(trigrams)
+        self._exact[text] = entry
+        bit = 1 << entry
+        for trigram in trigrams:
+            self._postings[trigram] |= bit
+        self._sizes[len(trigrams)] |= bit
+
+    def lookup(self, text, threshold):
+        # Returns the value whose text has the highest Dice coefficient over trigrams. Only
+        # entries that can reach the threshold are scored:
+        # - a Dice score of t needs a trigram count within [q*t/(2-t), q*(2-t)/t] for a query of q
+        # - it needs at least t*(q+size)/2 shared trigrams
+        text = normalizeFuzzyText(text)
+        if(not text):
+            return None
+        if(text in self._exact):
+            return self._values[self._exact[text]]
+
+        trigrams = getTrigrams(text)
+        q = len(trigrams)
+        if(threshold > 0):
+            lowest = math.ceil(q * threshold / (2 - threshold) - 1e-9)
+            highest = math.floor(q * (2 - threshold) / threshold + 1e-9)
+        else:
+            lowest, highest = 0, math.inf
+        inRange = 0
+        for size, entries in self._sizes.items():
+            if(lowest <= size <= highest):
+                inRange |= entries
+        if(not inRange):
+            return None
+
+        counts = []
+        for trigram in trigrams:
+            entries = self._postings.get(trigram)
+            if(entries):
+                addToCounts(counts, entries & inRange)
+        need = max(1, math.ceil(threshold * (q + lowest) / 2 - 1e-9))
+        candidates = getAtLeast(counts, need)
+
+        # Lowest bit first and only a higher score replaces the best, so ties go to the entry
+        # added first
+        best = None
+        bestScore = 0
+        while(candidates):
+            bit = candidates & -candidates
+            candidates ^= bit
+            entry = bit.bit_length() - 1
+            entryTrigrams = self._trigrams[entry]
+            score = 2.0 * len(trigrams & entryTrigrams) / (q + len(entryTrigrams))
+            if(score >= threshold and (best is None or score > bestScore)):
+                best = entry
+                bestScore = score
+        if(best is None):
+            return None
+        return self._values[best]
+
+    def __len__(self):
+        return len(self._values)
+
+
+class KeyMatcher:
+    def __init__(self, arrTextConf, arrOriginText, threshold=None):
+        # All indexes are built once per document, every alias lookup afterwards is a dict hit
+        # or, for aliases the OCR garbled, a walk over the postings of its trigrams
+        self._threshold = getMatchThreshold() if threshold is None else threshold
+        lines = [normalizeText(t) for t in arrOriginText]
+        self._lines = set(lines)
+        self._keys = {}
+        for item in arrTextConf:
+            self._keys.setdefault(normalizeText(item["key_name"]), item)
+
+        self._fuzzyKeys = FuzzyIndex()
+        for name, item in self._keys.items():
+            self._fuzzyKeys.add(name, item)
+        self._fuzzyLines = FuzzyIndex()
+        for name in lines:
+            self._fuzzyLines.add(name, name)
+
+    def matchGroup(self, aliases):
+        return self.matchNormalized([normalizeText(alias) for alias in aliases], aliases[0])
+
+    def matchNormalized(self, names, fallback):
+        for name in names:
+            item = self._keys.get(name)
+            if(item):
+                return {"Name": item["key_name"], "Confidence": item["key_conf"]}
+        for name in names:
+            if(name in self._lines):
+                return {"Name": name, "Confidence": 0}
+
+        if(self._threshold < 1):
+            for name in names:
+                item = self._fuzzyKeys.lookup(name, self._threshold)
+                if(item):
+                    return {"Name": item["key_name"], "Confidence": item["key_conf"]}
+            for name in names:
+                line = self._fuzzyLines.lookup(name, self._threshold)
+                if(line):
+                    return {"Name": line, "Confidence": 0}
+        return {"Name": fallback, "Confidence": 0}
+
+    def match(self, inputData):
+        return [self.matchGroup(aliases) for aliases in inputData]
+
+
+def getTextConfidence(inputData, arrTextConf, arrOriginText, threshold=None):
+    return KeyMatcher(arrTextConf, arrOriginText, threshold).match(inputData)
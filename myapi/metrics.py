@@ -0,0 +1,197 @@
+import bisect
+import threading
+
+# Every metric keeps one shard per recording thread, so recording is a plain update of memory
+# only that thread writes and never takes a lock. Shards are summed when the metrics are
+# rendered; the shards of threads that have exited are folded into one whenever a shard is
+# added or the metrics are rendered.
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+PARSE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+POLL_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BLOCK_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+
+def formatValue(value):
+    if(value == float('inf')):
+        return '+Inf'
+    if(isinstance(value, float) and value.is_integer()):
+        return str(int(value))
+    return repr(value)
+
+
+def formatLabels(labels):
+    if(not labels):
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelNames=()):
+        self._name = name
+        self._documentation = documentation
+        self._labelNames = tuple(labelNames)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = self._newShard()
+        self._lock = threading.Lock()
+
+    def _newShard(self):
+        return {}
+
+    def _mergeShard(self, into, shard):
+        for key, value in list(shard.items()):
+            into[key] = into.get(key, 0) + value
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if(shard is None):
+            shard = self._newShard()
+            with self._lock:
+                self._retireShards()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+        return shard
+
+    def _retireShards(self):
+        # Called with the lock held, also on every new shard so short-lived pool threads do
+        # not pile up when nothing scrapes the metrics
+        live = []
+        for thread, shard in self._shards:
+            if(thread.is_alive()):
+                live.append((thread, shard))
+            else:
+                self._mergeShard(self._retired, shard)
+        self._shards = live
+
+    def _labelKey(self, labels):
+        return tuple(labels[name] for name in self._labelNames)
+
+    def _collect(self):
+        with self._lock:
+            self._retireShards()
+            total = self._newShard()
+            self._mergeShard(total, self._retired)
+            for _, shard in self._shards:
+                self._mergeShard(total, shard)
+        return total
+
+    def _samples(self):
+        for key, value in sorted(self._collect().items()):
+            yield self._name, tuple(zip(self._labelNames, key)), value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self._name, self._documentation),
+                 '# TYPE {} {}'.format(self._name, self.kind)]
+        for name, labels, value in self._samples():
+            lines.append('{}{} {}'.format(name, formatLabels(labels), formatValue(value)))
+        return '\n'.join(lines)
+
+    @property
+    def name(self):
+        return self._name
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, n=1, **labels):
+        shard = self._shard()
+        key = self._labelKey(labels)
+        shard[key] = shard.get(key, 0) + n
+
+    def value(self, **labels):
+        return self._collect().get(self._labelKey(labels), 0)
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, n=1, **labels):
+        self.inc(-n, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        self._buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation)
+
+    def _newShard(self):
+        # Counts per bucket (the last one is +Inf), then the sum and count of observations
+        return [[0] * (len(self._buckets) + 1), 0.0, 0]
+
+    def _mergeShard(self, into, shard):
+        counts, total, n = shard[0][:], shard[1], shard[2]
+        for i, c in enumerate(counts):
+            into[0][i] += c
+        into[1] += total
+        into[2] += n
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[0][bisect.bisect_left(self._buckets, value)] += 1
+        shard[1] += value
+        shard[2] += 1
+
+    def _samples(self):
+        counts, total, n = self._collect()
+        cumulative = 0
+        for bound, c in zip(self._buckets + (float('inf'),), counts):
+            cumulative += c
+            yield self._name + '_bucket', (('le', formatValue(float(bound))),), cumulative
+        yield self._name + '_sum', (), total
+        yield self._name + '_count', (), n
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelNames=()):
+        return self.register(Counter(name, documentation, labelNames))
+
+    def gauge(self, name, documentation, labelNames=()):
+        return self.register(Gauge(name, documentation, labelNames))
+
+    def histogram(self, name, documentation, buckets):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+documentSeconds = REGISTRY.histogram(
+    'textract_document_seconds', 'End-to-end time to process one document.', LATENCY_BUCKETS)
+jobSeconds = REGISTRY.histogram(
+    'textract_job_seconds', 'Time from starting a Textract job until it finished.', LATENCY_BUCKETS)
+jobPolls = REGISTRY.histogram(
+    'textract_job_polls', 'Status checks made per Textract job.', POLL_BUCKETS)
+documentPages = REGISTRY.histogram(
+    'textract_document_pages', 'Pages per processed document.', PAGE_BUCKETS)
+documentBlocks = REGISTRY.histogram(
+    'textract_document_blocks', 'Textract blocks per processed document.', BLOCK_BUCKETS)
+parseSeconds = REGISTRY.histogram(
+    'textract_parse_seconds', 'Time spent building trp.Document, without waiting for result pages.',
+    PARSE_BUCKETS)
+cacheRequests = REGISTRY.counter(
+    'textract_result_cache_requests_total', 'Result cache lookups by result.', ('result',))
+documentsInFlight = REGISTRY.gauge(
+    'textract_documents_in_flight', 'Documents currently being processed.')
+failures = REGISTRY.counter(
+    'textract_failures_total', 'Documents that could not be processed, by reason.', ('reason',))
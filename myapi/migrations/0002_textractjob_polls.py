@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 14:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='textractjob',
+            name='polls',
+            field=models.IntegerField(default=0),
+        ),
+    ]
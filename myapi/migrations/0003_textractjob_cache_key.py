@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapi', '0002_textractjob_polls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='textractjob',
+            name='cache_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapi', '0003_textractjob_cache_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InputFormatTemplate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('input_format', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
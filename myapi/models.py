@@ -1,3 +1,33 @@
 from django.db import models
 
 # Create your models here.
+
+
+class TextractJob(models.Model):
+    IN_PROGRESS = 'IN_PROGRESS'
+    SUCCEEDED = 'SUCCEEDED'
+    PARTIAL_SUCCESS = 'PARTIAL_SUCCESS'
+    FAILED = 'FAILED'
+
+    job_id = models.CharField(max_length=64, unique=True)
+    document_name = models.CharField(max_length=1024)
+    input_format = models.TextField()
+    status = models.CharField(max_length=32, default=IN_PROGRESS)
+    result = models.TextField(blank=True, default='')
+    polls = models.IntegerField(default=0)
+    cache_key = models.CharField(max_length=64, blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{} ({})".format(self.job_id, self.status)
+
+
+class InputFormatTemplate(models.Model):
+    name = models.CharField(max_length=255, blank=True, default='')
+    content_hash = models.CharField(max_length=64, unique=True)
+    input_format = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "{} ({})".format(self.name or self.content_hash[:12], self.pk)
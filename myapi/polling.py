@@ -0,0 +1,119 @@
+import random
+import time
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+IN_PROGRESS = 'IN_PROGRESS'
+SUCCEEDED = 'SUCCEEDED'
+PARTIAL_SUCCESS = 'PARTIAL_SUCCESS'
+FAILED = 'FAILED'
+TIMED_OUT = 'TIMED_OUT'
+
+THROTTLING_CODES = frozenset([
+    'ThrottlingException', 'ProvisionedThroughputExceededException', 'LimitExceededException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'SlowDown',
+])
+
+
+class PollingStrategy:
+    def __init__(self, firstDelay=1.0, interval=1.0, factor=1.5, maxInterval=10.0, jitter=0.1, deadline=900.0):
+        self._firstDelay = firstDelay
+        self._interval = interval
+        self._factor = factor
+        self._maxInterval = maxInterval
+        self._jitter = jitter
+        self._deadline = deadline
+
+    @classmethod
+    def fromSettings(cls, **overrides):
+        options = dict(getattr(settings, 'TEXTRACT_POLLING', {}))
+        options.update(overrides)
+        return cls(**options)
+
+    def _withJitter(self, delay):
+        return max(0.0, delay * (1 + random.uniform(-self._jitter, self._jitter)))
+
+    def delays(self):
+        yield self._withJitter(self._firstDelay)
+        delay = self._interval
+        while(True):
+            yield self._withJitter(delay)
+            delay = min(delay * self._factor, self._maxInterval)
+
+    @property
+    def deadline(self):
+        return self._deadline
+
+
+class PollResult:
+    def __init__(self, jobId, status, polls, elapsed):
+        self._jobId = jobId
+        self._status = status
+        self._polls = polls
+        self._elapsed = elapsed
+
+    def __str__(self):
+        return "Job {} finished with status {} after {} polls in {:.1f}s".format(
+            self._jobId, self._status, self._polls, self._elapsed)
+
+    def __bool__(self):
+        return self.succeeded
+
+    @property
+    def jobId(self):
+        return self._jobId
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def polls(self):
+        return self._polls
+
+    @property
+    def elapsed(self):
+        return self._elapsed
+
+    @property
+    def succeeded(self):
+        # PARTIAL_SUCCESS still has results for the pages Textract could read
+        return self._status in (SUCCEEDED, PARTIAL_SUCCESS)
+
+
+def pollJob(client, jobId, strategy=None):
+    if(strategy is None):
+        strategy = PollingStrategy.fromSettings()
+
+    start = time.time()
+    polls = 0
+    attempts = 0
+    for delay in strategy.delays():
+        # The status is always checked at least once, even with a zero deadline
+        remaining = strategy.deadline - (time.time() - start)
+        if(attempts and remaining <= 0):
+            break
+        attempts += 1
+        time.sleep(min(delay, max(remaining, 0)))
+
+        # Only the status is needed here, the result pages are fetched once the job is done
+        try:
+            response = client.get_document_analysis(JobId=jobId, MaxResults=1)
+        except ClientError as e:
+            # A throttled poll just waits for the next, longer, delay
+            if(not isThrottlingError(e)):
+                raise
+            print("WARNING: Status check for job {} throttled, backing off".format(jobId))
+            continue
+        polls += 1
+        status = response["JobStatus"]
+        if(status != IN_PROGRESS):
+            return PollResult(jobId, status, polls, time.time() - start)
+
+    return PollResult(jobId, TIMED_OUT, polls, time.time() - start)
+
+
+def isThrottlingError(e):
+    return isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in THROTTLING_CODES
+
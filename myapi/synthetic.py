@@ -0,0 +1,235 @@
+import random
+import uuid
+
+WORDS = [
+    "invoice", "number", "date", "shipped", "origin", "dest", "airbill", "pieces", "description",
+    "weight", "rate", "amount", "total", "bakery", "logistics", "trays", "empty", "bun", "pallet",
+    "freight", "charges", "consignee", "shipper", "reference", "service", "delivered", "remit",
+    "$2,700.00", "13500", "12/07/2018", "975772528", "st.", "paul", "mn", "55106", "inc.",
+]
+
+
+class SyntheticDocument:
+    # Textract-shaped block graphs: every page has `linesPerPage` lines, then `keyValuesPerPage`
+    # form fields (a `selectionRate` share of them checkboxes) and `tablesPerPage` tables of
+    # tableRows x tableColumns cells, a `spanRate` share of them merged with the cell to their right
+    def __init__(self, pages=1, linesPerPage=40, wordsPerLine=6, blocksPerResponse=1000, seed=0,
+                 keyValuesPerPage=0, tablesPerPage=0, tableRows=10, tableColumns=5, spanRate=0.0,
+                 selectionRate=0.0):
+        self._pages = pages
+        self._linesPerPage = linesPerPage
+        self._wordsPerLine = wordsPerLine
+        self._blocksPerResponse = blocksPerResponse
+        self._keyValuesPerPage = keyValuesPerPage
+        self._tablesPerPage = tablesPerPage
+        self._tableRows = tableRows
+        self._tableColumns = tableColumns
+        self._spanRate = spanRate
+        self._selectionRate = selectionRate
+        self._random = random.Random(seed)
+
+    def _newId(self):
+        return str(uuid.UUID(int=self._random.getrandbits(128), version=4))
+
+    def _confidence(self):
+        return self._random.uniform(40.0, 99.9)
+
+    def _geometry(self, left, top, width, height):
+        return {
+            "BoundingBox": {"Width": width, "Height": height, "Left": left, "Top": top},
+            "Polygon": [
+                {"X": left, "Y": top},
+                {"X": left + width, "Y": top},
+                {"X": left + width, "Y": top + height},
+                {"X": left, "Y": top + height},
+            ],
+        }
+
+    def _words(self, count, left, top, width, height, page):
+        words = []
+        wordWidth = width / max(count, 1)
+        for i in range(count):
+            words.append({
+                "BlockType": "WORD",
+                "Confidence": self._confidence(),
+                "Text": self._random.choice(WORDS),
+                "TextType": "PRINTED",
+                "Geometry": self._geometry(left + i * wordWidth, top, wordWidth * 0.9, height),
+                "Id": self._newId(),
+                "Page": page,
+            })
+        return words
+
+    def _line(self, words, left, top, width, height, page):
+        return {
+            "BlockType": "LINE",
+            "Confidence": self._confidence(),
+            "Text": " ".join(w["Text"] for w in words),
+            "Geometry": self._geometry(left, top, width, height),
+            "Id": self._newId(),
+            "Relationships": [{"Type": "CHILD", "Ids": [w["Id"] for w in words]}],
+            "Page": page,
+        }
+
+    def _selectionElement(self, left, top, width, height, page):
+        return {
+            "BlockType": "SELECTION_ELEMENT",
+            "Confidence": self._confidence(),
+            "SelectionStatus": self._random.choice(["SELECTED", "NOT_SELECTED"]),
+            "Geometry": self._geometry(left, top, width, height),
+            "Id": self._newId(),
+            "Page": page,
+        }
+
+    def _keyValue(self, top, height, page):
+        # LINE blocks for the key and value text, the KEY and VALUE sets pointing at the same words
+        blocks = []
+        keyWords = self._words(self._random.randint(1, 3), 0.05, top, 0.3, height, page)
+        keyLine = self._line(keyWords, 0.05, top, 0.3, height, page)
+        blocks.append(keyLine)
+        blocks.extend(keyWords)
+        lines = [keyLine]
+
+        if(self._random.random() < self._selectionRate):
+            valueChildren = [self._selectionElement(0.45, top, height, height, page)]
+            blocks.extend(valueChildren)
+        else:
+            valueChildren = self._words(self._random.randint(1, 4), 0.45, top, 0.4, height, page)
+            valueLine = self._line(valueChildren, 0.45, top, 0.4, height, page)
+            blocks.append(valueLine)
+            blocks.extend(valueChildren)
+            lines.append(valueLine)
+
+        value = {
+            "BlockType": "KEY_VALUE_SET",
+            "Confidence": self._confidence(),
+            "Geometry": self._geometry(0.45, top, 0.4, height),
+            "Id": self._newId(),
+            "Relationships": [{"Type": "CHILD", "Ids": [c["Id"] for c in valueChildren]}],
+            "EntityTypes": ["VALUE"],
+            "Page": page,
+        }
+        key = {
+            "BlockType": "KEY_VALUE_SET",
+            "Confidence": self._confidence(),
+            "Geometry": self._geometry(0.05, top, 0.3, height),
+            "Id": self._newId(),
+            "Relationships": [
+                {"Type": "VALUE", "Ids": [value["Id"]]},
+                {"Type": "CHILD", "Ids": [w["Id"] for w in keyWords]},
+            ],
+            "EntityTypes": ["KEY"],
+            "Page": page,
+        }
+        blocks.append(key)
+        blocks.append(value)
+        return lines + [key, value], blocks
+
+    def _table(self, top, rowHeight, page):
+        blocks = []
+        cells = []
+        columnWidth = 0.9 / max(self._tableColumns, 1)
+        for r in range(self._tableRows):
+            cellTop = top + r * rowHeight
+            c = 0
+            while(c < self._tableColumns):
+                span = 1
+                if(c + 1 < self._tableColumns and self._random.random() < self._spanRate):
+                    span = 2
+                left = 0.05 + c * columnWidth
+                width = columnWidth * span
+                words = self._words(self._random.randint(0, 3), left, cellTop, width * 0.9, rowHeight * 0.8, page)
+                blocks.extend(words)
+                cell = {
+                    "BlockType": "CELL",
+                    "Confidence": self._confidence(),
+                    "RowIndex": r + 1,
+                    "ColumnIndex": c + 1,
+                    "RowSpan": 1,
+                    "ColumnSpan": span,
+                    "Geometry": self._geometry(left, cellTop, width, rowHeight),
+                    "Id": self._newId(),
+                    "Page": page,
+                }
+                if(words):
+                    cell["Relationships"] = [{"Type": "CHILD", "Ids": [w["Id"] for w in words]}]
+                cells.append(cell)
+                c += span
+
+        table = {
+            "BlockType": "TABLE",
+            "Confidence": self._confidence(),
+            "Geometry": self._geometry(0.05, top, 0.9, rowHeight * self._tableRows),
+            "Id": self._newId(),
+            "Relationships": [{"Type": "CHILD", "Ids": [cell["Id"] for cell in cells]}],
+            "Page": page,
+        }
+        blocks.extend(cells)
+        blocks.append(table)
+        return table, blocks
+
+    def pageBlocks(self, page):
+        pageBlock = {
+            "BlockType": "PAGE",
+            "Geometry": self._geometry(0.0, 0.0, 1.0, 1.0),
+            "Id": self._newId(),
+            "Relationships": [{"Type": "CHILD", "Ids": []}],
+            "Page": page,
+        }
+        blocks = [pageBlock]
+        children = pageBlock["Relationships"][0]["Ids"]
+
+        slots = self._linesPerPage + self._keyValuesPerPage + self._tablesPerPage * self._tableRows
+        lineHeight = 0.9 / max(slots, 1)
+        slot = 0
+        for i in range(self._linesPerPage):
+            top = 0.05 + slot * lineHeight
+            width = self._random.uniform(0.2, 0.8)
+            words = self._words(self._wordsPerLine, 0.05, top, width, lineHeight * 0.8, page)
+            line = self._line(words, 0.05, top, width, lineHeight * 0.8, page)
+            children.append(line["Id"])
+            blocks.append(line)
+            blocks.extend(words)
+            slot += 1
+
+        for i in range(self._keyValuesPerPage):
+            pageChildren, kvBlocks = self._keyValue(0.05 + slot * lineHeight, lineHeight * 0.8, page)
+            children.extend(b["Id"] for b in pageChildren)
+            blocks.extend(kvBlocks)
+            slot += 1
+
+        for i in range(self._tablesPerPage):
+            table, tableBlocks = self._table(0.05 + slot * lineHeight, lineHeight, page)
+            children.append(table["Id"])
+            blocks.extend(tableBlocks)
+            slot += self._tableRows
+        return blocks
+
+    def blocks(self):
+        for page in range(1, self._pages + 1):
+            for block in self.pageBlocks(page):
+                yield block
+
+    def responsePages(self):
+        # Split the blocks the way GetDocumentAnalysis pages them, chained by NextToken
+        responses = []
+        blocks = []
+        for block in self.blocks():
+            blocks.append(block)
+            if(len(blocks) == self._blocksPerResponse):
+                responses.append(blocks)
+                blocks = []
+        if(blocks or not responses):
+            responses.append(blocks)
+
+        pages = []
+        for index, blocks in enumerate(responses):
+            response = {
+                "DocumentMetadata": {"Pages": self._pages},
+                "JobStatus": "SUCCEEDED",
+                "Blocks": blocks,
+            }
+            if(index < len(responses) - 1):
+                response["NextToken"] = "page-{}".format(index + 1)
+            pages.append(response)
+        return pages
@@ -1,3 +1,778 @@
-from django.test import TestCase
+import io
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from botocore.exceptions import ClientError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import backends, cache, clients, trp
+from .batch import getBatchConcurrency, iterBatch
+from .cache import ResultCache
+from .formats import compileFormat
+from .instrumentation import NULL_TIMINGS, collectTimings, getTimings, stage
+from .lineitems import extractLineItems
+from .matching import FuzzyIndex, KeyMatcher, getTrigrams, normalizeFuzzyText
+from .metrics import Counter, Histogram
+from .polling import PollingStrategy, pollJob
+from .synthetic import SyntheticDocument
+from .trp import Document
+from .views import cacheResults, startJob, streamJobResults
+
+_ids = itertools.count()
+
+INPUT_FORMAT = {
+    "input_first": [["invoice number", "Invoice #"], ["date shipped"], ["missing key"]],
+    "input_second": [["pieces", "Qty"], ["description"], ["rate"], ["price"]],
+}
+
+NO_WAIT_POLLING = {'firstDelay': 0, 'interval': 0, 'maxInterval': 0, 'jitter': 0, 'deadline': 5}
+
+
+def newId():
+    return "b{}".format(next(_ids))
+
+
+def geometry(left, top, width=0.1, height=0.02):
+    return {
+        "BoundingBox": {"Width": width, "Height": height, "Left": left, "Top": top},
+        "Polygon": [{"X": left, "Y": top}, {"X": left + width, "Y": top},
+                    {"X": left + width, "Y": top + height}, {"X": left, "Y": top + height}],
+    }
+
+
+def words(text, left, top):
+    return [{"BlockType": "WORD", "Id": newId(), "Text": w, "Confidence": 99.0, "Geometry": geometry(left, top)}
+            for w in text.split()]
+
+
+def line(text, left, top, width=0.1):
+    ws = words(text, left, top)
+    block = {"BlockType": "LINE", "Id": newId(), "Text": text, "Confidence": 98.0,
+             "Geometry": geometry(left, top, width), "Relationships": [{"Type": "CHILD", "Ids": [w["Id"] for w in ws]}]}
+    return [block] + ws
+
+
+def keyValue(key, value, top):
+    # The KEY and VALUE sets point at the words of their LINEs, like Textract's own output
+    keyLine = line(key, 0.1, top)
+    valueLine = line(value, 0.5, top)
+    keyWords = keyLine[1:]
+    valueWords = valueLine[1:]
+    valueBlock = {"BlockType": "KEY_VALUE_SET", "Id": newId(), "EntityTypes": ["VALUE"], "Confidence": 70.0,
+                  "Geometry": geometry(0.5, top),
+                  "Relationships": [{"Type": "CHILD", "Ids": [w["Id"] for w in valueWords]}]}
+    keyBlock = {"BlockType": "KEY_VALUE_SET", "Id": newId(), "EntityTypes": ["KEY"], "Confidence": 60.0,
+                "Geometry": geometry(0.1, top),
+                "Relationships": [{"Type": "VALUE", "Ids": [valueBlock["Id"]]},
+                                  {"Type": "CHILD", "Ids": [w["Id"] for w in keyWords]}]}
+    return keyLine + valueLine + [keyBlock, valueBlock]
+
+
+def table(rows, top, spans=None):
+    # rows of cell texts; spans maps (row, column) (0-based) to (rowSpan, columnSpan), cells
+    # covered by a span are left out
+    spans = spans or {}
+    blocks = []
+    cells = []
+    for r, row in enumerate(rows):
+        for c, text in enumerate(row):
+            if(text is None):
+                continue
+            ws = words(text, 0.1 + 0.2 * c, top + 0.03 * r)
+            rowSpan, columnSpan = spans.get((r, c), (1, 1))
+            cell = {"BlockType": "CELL", "Id": newId(), "Confidence": 90.0 + c, "RowIndex": r + 1,
+                    "ColumnIndex": c + 1, "RowSpan": rowSpan, "ColumnSpan": columnSpan,
+                    "Geometry": geometry(0.1 + 0.2 * c, top + 0.03 * r)}
+            if(ws):
+                cell["Relationships"] = [{"Type": "CHILD", "Ids": [w["Id"] for w in ws]}]
+            blocks.extend(ws)
+            cells.append(cell)
+    tableBlock = {"BlockType": "TABLE", "Id": newId(), "Confidence": 95.0, "Geometry": geometry(0.1, top, 0.8, 0.3),
+                  "Relationships": [{"Type": "CHILD", "Ids": [c["Id"] for c in cells]}]}
+    return blocks + cells + [tableBlock]
+
+
+def page(*contents):
+    blocks = [b for content in contents for b in content]
+    pageBlock = {"BlockType": "PAGE", "Id": newId(), "Geometry": geometry(0, 0, 1, 1),
+                 "Relationships": [{"Type": "CHILD", "Ids": [b["Id"] for b in blocks
+                                                             if b["BlockType"] in ("LINE", "TABLE")]}]}
+    return [pageBlock] + blocks
+
+
+def invoicePages():
+    header = ["PIECES", "DESCRIPTION", "RATE"]
+    return [
+        page(keyValue("Invoice Number", "975772528", 0.05),
+             table([header, ["13", "bun trays", "$2,700.00"], ["", "", ""], ["2", "pallets", "$10.00"]], 0.5)),
+        page(table([["9", "crates", "$1.00"]], 0.05)),
+    ]
+
+
+class FakeTextract:
+    def __init__(self, statuses):
+        self._statuses = list(statuses)
+        self.calls = 0
+
+    def get_document_analysis(self, JobId, MaxResults=None, NextToken=None):
+        self.calls += 1
+        status = self._statuses.pop(0) if self._statuses else 'SUCCEEDED'
+        if(isinstance(status, Exception)):
+            raise status
+        return {"JobStatus": status}
+
+
+def throttlingError():
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'GetDocumentAnalysis')
+
+
+class PollJobTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('myapi.polling.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_zero_deadline_still_polls_once(self):
+        client = FakeTextract(['IN_PROGRESS'])
+        result = pollJob(client, 'job', PollingStrategy(firstDelay=0, deadline=0))
+        self.assertEqual(client.calls, 1)
+        self.assertEqual((result.status, result.polls), ('TIMED_OUT', 1))
+
+        result = pollJob(FakeTextract(['SUCCEEDED']), 'job', PollingStrategy(firstDelay=0, deadline=0))
+        self.assertEqual(result.status, 'SUCCEEDED')
+
+    def test_times_out_at_deadline(self):
+        client = FakeTextract(['IN_PROGRESS'] * 1000)
+        with mock.patch('myapi.polling.time.time', side_effect=itertools.count(0, 1)):
+            result = pollJob(client, 'job', PollingStrategy(firstDelay=0, interval=1, jitter=0, deadline=5))
+        self.assertEqual(result.status, 'TIMED_OUT')
+        self.assertFalse(result)
+
+    def test_throttled_status_check_is_retried(self):
+        client = FakeTextract([throttlingError(), throttlingError(), 'IN_PROGRESS', 'SUCCEEDED'])
+        result = pollJob(client, 'job', PollingStrategy(firstDelay=0, jitter=0, deadline=60))
+        self.assertTrue(result)
+        self.assertEqual(result.polls, 2)
+
+    def test_other_client_errors_are_raised(self):
+        error = ClientError({'Error': {'Code': 'InvalidJobIdException', 'Message': 'no'}}, 'GetDocumentAnalysis')
+        with self.assertRaises(ClientError):
+            pollJob(FakeTextract([error]), 'job', PollingStrategy(firstDelay=0, deadline=60))
+
+
+class ResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def test_round_trip(self):
+        resultCache = ResultCache(self.directory)
+        resultCache.set('a', [{"Blocks": []}])
+        self.assertEqual(resultCache.get('a'), [{"Blocks": []}])
+        self.assertIsNone(resultCache.get('missing'))
+
+    def test_background_writes(self):
+        resultCache = ResultCache(self.directory)
+        with mock.patch.object(resultCache, 'set', side_effect=OSError("disk full")):
+            resultCache.setInBackground('a', [1]).result()
+        resultCache.setInBackground('b', [2])
+        resultCache.flush()
+        self.assertIsNone(resultCache.get('a'))
+        self.assertEqual(resultCache.get('b'), [2])
+
+    def test_expired_entries_are_misses(self):
+        resultCache = ResultCache(self.directory, ttl=60)
+        resultCache.set('a', [1])
+        old = time.time() - 120
+        os.utime(os.path.join(self.directory, 'a.json.gz'), (old, old))
+        self.assertIsNone(resultCache.get('a'))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'a.json.gz')))
+
+    def test_evicts_least_recently_used(self):
+        resultCache = ResultCache(self.directory)
+        payload = [list(range(200))]
+        for i, key in enumerate(['a', 'b', 'c']):
+            resultCache.set(key, payload)
+            os.utime(os.path.join(self.directory, key + '.json.gz'), (1000 + i, time.time()))
+        size = os.path.getsize(os.path.join(self.directory, 'a.json.gz'))
+
+        resultCache._maxBytes = size * 2
+        resultCache.get('a')
+        resultCache._evict()
+        self.assertEqual(sorted(os.listdir(self.directory)), ['a.json.gz', 'c.json.gz'])
+
+
+class MatchingTests(SimpleTestCase):
+    def test_fuzzy_index(self):
+        index = FuzzyIndex()
+        index.add("invoice number", 1)
+        index.add("date shipped", 2)
+        self.assertEqual(index.lookup("invoice number", 0.75), 1)
+        self.assertEqual(index.lookup("Invoice  Numbr.", 0.75), 1)
+        self.assertEqual(index.lookup("date shippped", 0.75), 2)
+        self.assertIsNone(index.lookup("total amount", 0.75))
+
+    def test_fuzzy_index_matches_a_full_scan(self):
+        rnd = random.Random(3)
+        texts = ["".join(rnd.choice("abc de") for _ in range(rnd.randint(1, 14))) for _ in range(300)]
+        index = FuzzyIndex()
+        for i, text in enumerate(texts):
+            index.add(text, i)
+
+        def scan(query, threshold):
+            # Best Dice score over every entry, the first entry added wins ties
+            best, bestScore = None, 0
+            seen = set()
+            for i, text in enumerate(texts):
+                text = normalizeFuzzyText(text)
+                if(not text or text in seen):
+                    continue
+                seen.add(text)
+                a, b = getTrigrams(normalizeFuzzyText(query)), getTrigrams(text)
+                score = 2.0 * len(a & b) / (len(a) + len(b))
+                if(a & b and score >= threshold and (best is None or score > bestScore)):
+                    best, bestScore = i, score
+            return best
+
+        for _ in range(200):
+            query = "".join(rnd.choice("abc de") for _ in range(rnd.randint(1, 14)))
+            if(normalizeFuzzyText(query) in set(normalizeFuzzyText(t) for t in texts)):
+                continue
+            for threshold in (0, 0.5, 0.75, 0.9):
+                self.assertEqual(index.lookup(query, threshold), scan(query, threshold), (query, threshold))
+
+    def test_key_matcher_exact_aliases(self):
+        keys = [{"key_name": "Invoice #", "key_conf": 60.0}, {"key_name": "ORIGIN", "key_conf": 70.0}]
+        lines = ["invoice #", "origin", "dest"]
+        matcher = KeyMatcher(keys, lines, 1)
+        # A key confidence beats an earlier alias that is only a line
+        self.assertEqual(matcher.matchGroup(["dest", "Origin"]), {"Name": "ORIGIN", "Confidence": 70.0})
+        self.assertEqual(matcher.matchGroup(["invoice number", "INVOICE #"]), {"Name": "Invoice #", "Confidence": 60.0})
+        self.assertEqual(matcher.matchGroup(["weight", "Dest"]), {"Name": "dest", "Confidence": 0})
+        self.assertEqual(matcher.matchGroup(["Total", "sum"]), {"Name": "Total", "Confidence": 0})
+
+    def test_key_matcher_falls_back_to_fuzzy_matches(self):
+        keys = [{"key_name": "Invoice Numbr", "key_conf": 60.0}, {"key_name": "Airbill", "key_conf": 70.0}]
+        lines = ["airbill", "date shippped", "origin"]
+        matcher = KeyMatcher(keys, lines, 0.75)
+        self.assertEqual(matcher.matchGroup(["airbill"]), {"Name": "Airbill", "Confidence": 70.0})
+        self.assertEqual(matcher.matchGroup(["invoice number"]), {"Name": "Invoice Numbr", "Confidence": 60.0})
+        self.assertEqual(matcher.matchGroup(["date shipped"]), {"Name": "date shippped", "Confidence": 0})
+        self.assertEqual(matcher.matchGroup(["Total", "sum"]), {"Name": "Total", "Confidence": 0})
+
+    def test_exact_threshold_disables_fuzzy_matching(self):
+        matcher = KeyMatcher([{"key_name": "Invoice Numbr", "key_conf": 60.0}], [], 1)
+        self.assertEqual(matcher.matchGroup(["invoice number"]), {"Name": "invoice number", "Confidence": 0})
+
+
+class TrpTests(SimpleTestCase):
+    def test_table_grid_expands_spans(self):
+        rows = [["A", "B", "C"], ["wide", None, "x"], ["tall", "y", "z"], [None, "w", "v"]]
+        doc = Document({"Blocks": page(table(rows, 0.1, {(1, 0): (1, 2), (2, 0): (2, 1)}))})
+        grid = doc.pages[0].tables[0]
+        self.assertEqual((grid.rowCount, grid.columnCount), (4, 3))
+        self.assertIs(grid.getCell(1, 0), grid.getCell(1, 1))
+        self.assertIs(grid.getCell(2, 0), grid.getCell(3, 0))
+        self.assertEqual(grid.getColumnIndex("c"), 2)
+        self.assertEqual([cell.text.strip() for cell in grid.getColumn("C")], ["x", "z", "v"])
+        self.assertIsNone(grid.getCell(9, 9))
+
+    def test_reading_order_keeps_wide_lines_in_place(self):
+        blocks = page(line("TITLE", 0.1, 0.02, 0.8), line("A1", 0.1, 0.1, 0.3), line("A2", 0.1, 0.2, 0.3),
+                      line("B1", 0.6, 0.1, 0.3), line("B2", 0.6, 0.2, 0.3), line("FOOTER", 0.1, 0.9, 0.8))
+        doc = Document({"Blocks": blocks})
+        order = [text for _, text in doc.pages[0].getLinesInReadingOrder()]
+        self.assertEqual(order, ["TITLE", "A1", "A2", "B1", "B2", "FOOTER"])
+
+    def test_reading_order_reads_each_band_column_by_column(self):
+        blocks = page(line("B2", 0.6, 0.6, 0.3), line("A2", 0.1, 0.6, 0.3), line("RULE", 0.1, 0.5, 0.8),
+                      line("B1", 0.6, 0.1, 0.3), line("A1", 0.1, 0.1, 0.3), line("A1b", 0.1, 0.2, 0.3))
+        doc = Document({"Blocks": blocks})
+        self.assertEqual(doc.pages[0].getLinesInReadingOrder(),
+                         [[0, "A1"], [0, "A1b"], [1, "B1"], [0, "RULE"], [0, "A2"], [1, "B2"]])
+        self.assertEqual(doc.pages[0].getTextInReadingOrder(), "A1\nA1b\nB1\nRULE\nA2\nB2\n")
+
+    def test_line_items_are_stitched_across_pages(self):
+        blocks = [b for p in invoicePages() for b in p]
+        doc = Document({"Blocks": blocks})
+        groups = [{"Name": "pieces"}, {"Name": "description"}, {"Name": "rate"}, {"Name": "price"}]
+        items = extractLineItems(doc, compileFormat(INPUT_FORMAT), groups)
+        self.assertEqual([[c["Value"] for c in row] for row in items],
+                         [["13", "bun trays", "$2,700.00", ""], ["2", "pallets", "$10.00", ""],
+                          ["9", "crates", "$1.00", ""]])
+        self.assertEqual([c["Name"] for c in items[2]], ["PIECES", "DESCRIPTION", "RATE", "price"])
+        self.assertEqual(items[0][3]["Confidence"], 0)
+
+
+    def test_lazy_and_eager_documents_match(self):
+        blocks = [b for p in invoicePages() for b in p]
+        eager = Document({"Blocks": blocks})
+        lazy = Document({"Blocks": blocks}, lazy=True)
+        def contentIds(doc):
+            return [[getattr(item, 'key', item).id for item in p.content] for p in doc.pages]
+
+        self.assertEqual(contentIds(lazy), contentIds(eager))
+        self.assertEqual(len(contentIds(eager)[0]), 4)
+        self.assertEqual(str(lazy), str(eager))
+
+    def test_lazy_page_parses_only_what_is_read(self):
+        lazy = Document({"Blocks": [b for p in invoicePages() for b in p]}, lazy=True)
+        page = lazy.pages[0]
+        self.assertEqual(page.form.getFieldByKey("Invoice Number").value.text, "975772528")
+        self.assertEqual(page._lines, [])
+        self.assertIsNotNone(page._blockMap)
+
+        page.lines
+        page.tables
+        self.assertIsNotNone(page._blockMap)
+        page.id
+        self.assertIsNone(page._blockMap)
+
+
+    def test_words_are_shared_between_parents(self):
+        blocks = keyValue("Total", "$10.00", 0.1)
+        keyWord = blocks[1]
+        cell = {"BlockType": "CELL", "Id": newId(), "Confidence": 90.0, "RowIndex": 1, "ColumnIndex": 1,
+                "RowSpan": 1, "ColumnSpan": 1, "Geometry": geometry(0.1, 0.1),
+                "Relationships": [{"Type": "CHILD", "Ids": [keyWord["Id"]]}]}
+        tableBlock = {"BlockType": "TABLE", "Id": newId(), "Confidence": 95.0, "Geometry": geometry(0.1, 0.1),
+                      "Relationships": [{"Type": "CHILD", "Ids": [cell["Id"]]}]}
+        doc = Document({"Blocks": page(blocks + [cell, tableBlock])})
+        p = doc.pages[0]
+        word = p.lines[0].words[0]
+        self.assertEqual(word.id, keyWord["Id"])
+        self.assertIs(p.form.fields[0].key.content[0], word)
+        self.assertIs(p.tables[0].rows[0].cells[0].content[0], word)
+
+
+    def test_geometry_store_matches_block_geometry(self):
+        blocks = list(SyntheticDocument(pages=1, seed=4).blocks())
+        store = trp.GeometryStore(blocks)
+        self.assertEqual(len(store), len(blocks))
+        for block in blocks:
+            view = store.getGeometry(block["Id"])
+            geometry = trp.Geometry(block["Geometry"])
+            self.assertEqual(str(view), str(geometry))
+            self.assertEqual([(p.x, p.y) for p in view.polygon], [(p.x, p.y) for p in geometry.polygon])
+
+        regions = [(0, 0, 1, 1), (0.1, 0.2, 0.6, 0.5), (0.5, 0.5, 0.52, 0.51), (2, 2, 3, 3)]
+        for contained in (True, False):
+            for region in regions:
+                with mock.patch.object(trp, 'numpy', None):
+                    fallback = store.getIdsInRegion(*region, contained=contained)
+                self.assertEqual(store.getIdsInRegion(*region, contained=contained), fallback)
+        self.assertEqual(len(store.getIdsInRegion(0, 0, 1, 1)), len(blocks))
+
+
+    def test_spatial_index_matches_a_full_scan(self):
+        blocks = list(SyntheticDocument(pages=1, seed=5).blocks())
+        store = trp.GeometryStore(blocks)
+        index = trp.SpatialIndex(store)
+        rows = [row for row in range(len(store)) if store.blockTypes[row] != "PAGE"]
+
+        def scan(left, top, right, bottom, contained):
+            ids = []
+            for row in rows:
+                l, t, w, h = store.getBox(row)
+                if(contained):
+                    inside = l >= left and t >= top and l + w <= right and t + h <= bottom
+                else:
+                    inside = l <= right and t <= bottom and l + w >= left and t + h >= top
+                if(inside):
+                    ids.append(store.ids[row])
+            return ids
+
+        def distance(row, x, y):
+            l, t, w, h = store.getBox(row)
+            return math.hypot(max(l - x, 0.0, x - l - w), max(t - y, 0.0, y - t - h))
+
+        rnd = random.Random(5)
+        for _ in range(50):
+            x0, x1 = sorted((rnd.random(), rnd.random()))
+            y0, y1 = sorted((rnd.random(), rnd.random()))
+            self.assertEqual(index.getIdsInRegion(x0, y0, x1, y1), scan(x0, y0, x1, y1, True))
+            self.assertEqual(index.getIdsIntersecting(x0, y0, x1, y1), scan(x0, y0, x1, y1, False))
+
+            x, y = rnd.random(), rnd.random()
+            for k, blockTypes in ((1, None), (5, ("LINE",)), (12, ("WORD", "LINE"))):
+                nearest = sorted((distance(row, x, y), row) for row in rows
+                                 if blockTypes is None or store.blockTypes[row] in blockTypes)[:k]
+                found = index.getNearestIds(x, y, k, blockTypes)
+                self.assertEqual([distance(store.getRow(i), x, y) for i in found], [d for d, _ in nearest])
+
+    def test_nearest_and_right_of_blocks(self):
+        blocks = page(line("Invoice Number", 0.1, 0.1, 0.2), line("975772528", 0.5, 0.1, 0.2),
+                      line("Date", 0.1, 0.3, 0.2), line("12/07/2018", 0.5, 0.31, 0.2))
+        p = Document({"Blocks": blocks}).pages[0]
+        self.assertEqual([b["BlockType"] for b in p.getNearestBlocks(0.15, 0.11, 2)], ["LINE", "WORD"])
+        self.assertEqual([b["Text"] for b in p.getBlocksRightOf(p.lines[0], 1, ("LINE",))], ["975772528"])
+        self.assertEqual([b["Text"] for b in p.getBlocksRightOf(p.lines[2], 1, ("LINE",))], ["12/07/2018"])
+        self.assertEqual(p.getBlocksRightOf(p.lines[1], 1, ("LINE",)), [])
+        self.assertEqual(p.getBlocksInRegion(0, 0, 1, 1, ("PAGE",)), [])
+
+
+    def test_rendering(self):
+        blocks = page(line("Bill To", 0.1, 0.02), keyValue("Date", "12/07/2018", 0.1),
+                      table([["Qty", "Rate"], ["2", "$1.00"]], 0.5))
+        doc = Document([{"Blocks": blocks}, {"Blocks": page(line("Page two", 0.1, 0.1))}])
+        # The rendering of the original trp, byte for byte
+        expected = ("\nDocument\n==========\n"
+                    "Page\n==========\n"
+                    "Line\n==========\nBill To\nWords\n----------\n[Bill][To]\n"
+                    "Line\n==========\nDate\nWords\n----------\n[Date]\n"
+                    "Line\n==========\n12/07/2018\nWords\n----------\n[12/07/2018]\n"
+                    "\nField\n==========\nKey: Date\nValue: 12/07/2018\n"
+                    "Table\n==========\nRow\n==========\n[Qty ][Rate ]\nRow\n==========\n[2 ][$1.00 ]\n\n"
+                    "\n\n"
+                    "Page\n==========\n"
+                    "Line\n==========\nPage two\nWords\n----------\n[Page][two]\n"
+                    "\n\n")
+        self.assertEqual(str(doc), expected)
+        self.assertEqual("".join(doc.iterRender()), expected)
+        self.assertEqual("".join(doc.iterText()), "".join(p.text for p in doc.pages))
+        self.assertEqual("".join(doc.iterText()), "Bill To\nDate\n12/07/2018\nPage two\n")
+
+
+    def test_document_stream_yields_pages_as_they_arrive(self):
+        responses = [{"Blocks": page(line("Page {}".format(i), 0.1, 0.1))} for i in range(3)]
+        consumed = []
+
+        def source():
+            for response in responses:
+                consumed.append(response)
+                yield response
+
+        stream = trp.DocumentStream(source())
+        pages = iter(stream)
+        self.assertEqual(next(pages).text, "Page 0\n")
+        self.assertEqual(len(consumed), 2)
+        self.assertEqual([p.text for p in pages], ["Page 1\n", "Page 2\n"])
+        self.assertEqual(stream.pageCount, 3)
+        with self.assertRaises(ValueError):
+            list(stream)
+
+    def test_document_stream_inputs(self):
+        response = {"Blocks": [b for p in invoicePages() for b in p]}
+        text = json.dumps(response)
+        for source in (response, text, text.encode('utf-8'), io.StringIO(text), [text, io.BytesIO(b'{"Blocks": []}')]):
+            pages = list(trp.DocumentStream(source, lazy=True))
+            self.assertEqual(len(pages), 2)
+            for p in pages:
+                self.assertEqual(set(p._blockMap), set(block["Id"] for block in p.blocks))
+            self.assertEqual(pages[0].form.getFieldByKey("Invoice Number").value.text, "975772528")
+
+
+    def test_form_key_indexes(self):
+        first = page(keyValue("Invoice Total", "$10.00", 0.1), keyValue("Ship Date:", "12/07/2018", 0.2),
+                     keyValue("INVOICE No.", "1", 0.3))
+        second = page(keyValue("Invoice no", "2", 0.1), keyValue("Date Invoiced", "12/11/2018", 0.2))
+        doc = Document({"Blocks": first + second})
+        form = doc.pages[0].form
+
+        def keys(fields):
+            return [field.key.text for field in fields]
+
+        self.assertEqual(keys(form.getFieldsByNormalizedKey("  SHIP date ")), ["Ship Date:"])
+        self.assertEqual(form.getFieldByNormalizedKey("invoice  NO:").value.text, "1")
+        self.assertEqual(keys(form.searchFieldsByPrefix("INVOICE")), ["Invoice Total", "INVOICE No."])
+        self.assertEqual(keys(form.searchFieldsByKey("date")), ["Ship Date:"])
+        self.assertEqual(keys(form.searchFieldsByKey("voice")), ["Invoice Total", "INVOICE No."])
+        self.assertEqual(form.searchFieldsByKey("weight"), [])
+
+        # The document form lists the fields of every page, in page order
+        self.assertEqual([field.value.text for field in doc.form.getFieldsByNormalizedKey("invoice no")], ["1", "2"])
+        self.assertEqual(keys(doc.form.searchFieldsByKey("invoice")),
+                         ["Invoice Total", "INVOICE No.", "Invoice no", "Date Invoiced"])
+
+        # Searched once, the indexes are rebuilt for a field added afterwards
+        form.addField(doc.pages[1].form.fields[1])
+        self.assertEqual(keys(form.searchFieldsByKey("date")), ["Ship Date:", "Date Invoiced"])
+        self.assertEqual(keys(form.searchFieldsByPrefix("date")), ["Date Invoiced"])
+
+
+class BatchTests(SimpleTestCase):
+    @override_settings(TEXTRACT_BATCH_CONCURRENCY=4)
+    def test_concurrency_is_validated_and_capped(self):
+        self.assertEqual(getBatchConcurrency(), 4)
+        self.assertEqual(getBatchConcurrency("2"), 2)
+        self.assertEqual(getBatchConcurrency(100), 4)
+        for requested in (0, -1, "x", 1.5, True):
+            with self.assertRaises(ValueError):
+                getBatchConcurrency(requested)
+
+    def test_iter_batch_bounds_items_in_flight(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def work(item):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return item * 2
+
+        results = dict(iterBatch(work, range(10), 3))
+        self.assertEqual(results, dict((i, i * 2) for i in range(10)))
+        self.assertLessEqual(running[1], 3)
+
+
+class TimingsTests(SimpleTestCase):
+    def test_collect_timings_restores_the_previous_timings(self):
+        with collectTimings() as outer:
+            with collectTimings() as inner:
+                with stage('parse'):
+                    pass
+            self.assertIs(getTimings(), outer)
+        self.assertIs(getTimings(), NULL_TIMINGS)
+        self.assertIn('parse', inner.asDict()['stagesMs'])
+        self.assertNotIn('parse', outer.asDict()['stagesMs'])
+
+        with stage('parse'):
+            pass
+        self.assertEqual(NULL_TIMINGS.asDict()['stagesMs'], {})
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_render(self):
+        histogram = Histogram('seconds', 'Test.', (1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.render().splitlines()[2:], [
+            'seconds_bucket{le="1"} 2', 'seconds_bucket{le="5"} 3', 'seconds_bucket{le="+Inf"} 4',
+            'seconds_sum 14.5', 'seconds_count 4'])
+
+    def test_shards_of_finished_threads_are_folded(self):
+        counter = Counter('total', 'Test.', ('result',))
+        threads = [threading.Thread(target=counter.inc, kwargs={'result': 'hit'}) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        counter.inc(result='miss')
+        self.assertLessEqual(len(counter._shards), 1)
+        self.assertEqual((counter.value(result='hit'), counter.value(result='miss')), (20, 1))
+
+
+class LocalBackendTestCase(TestCase):
+    # The whole request path against the offline stand-in, documents come from recordings
+    localBackend = {'latency': 0.0, 'throttleRate': 0.0, 'synthetic': {'pages': 2, 'linesPerPage': 5}}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        os.makedirs(os.path.join(self.directory, 'recordings'))
+        with open(os.path.join(self.directory, 'recordings', 'invoice.pdf.json'), 'w') as f:
+            json.dump({"Blocks": [b for p in invoicePages() for b in p]}, f)
+
+        options = dict(self.localBackend, recordings=os.path.join(self.directory, 'recordings'))
+        overrides = override_settings(
+            TEXTRACT_BACKEND='local', TEXTRACT_LOCAL_BACKEND=options, TEXTRACT_POLLING=NO_WAIT_POLLING,
+            TEXTRACT_RESULT_CACHE={'directory': os.path.join(self.directory, 'cache')})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.resetSingletons()
+        self.addCleanup(self.resetSingletons)
+
+    def resetSingletons(self):
+        clients.resetClients()
+        backends._localDocuments = None
+        cache._resultCache = None
+
+    def post(self, path, body):
+        return self.client.post(path, json.dumps(body), content_type='application/json')
+
+
+class RequestTests(LocalBackendTestCase):
+    def test_lambda_handler(self):
+        response = self.post('/lambda_handler/', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()["body"]
+        self.assertEqual(body["output_first"][0], {"Name": "Invoice Number", "Confidence": 60.0, "Value": "975772528"})
+        self.assertEqual(body["output_first"][2], {"Name": "missing key", "Confidence": 0, "Value": ""})
+        self.assertEqual(len(body["output_second"]), 3)
+
+    def test_synthetic_document_without_recording(self):
+        response = self.post('/lambda_handler/', {"name": "scan.pdf", "inputFormat": INPUT_FORMAT})
+        self.assertEqual(response.status_code, 200)
+
+    def test_lambda_handler_uses_result_cache(self):
+        first = self.post('/lambda_handler/', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT})
+        cache.getResultCache().flush()
+        with mock.patch.object(backends.LocalTextractClient, 'start_document_analysis') as start:
+            second = self.post('/lambda_handler/', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT})
+        start.assert_not_called()
+        self.assertEqual(first.json(), second.json())
+
+    def test_partial_results_are_not_cached(self):
+        resultCache = cache.getResultCache()
+        cacheResults('partial', [{"Blocks": []}], 'PARTIAL_SUCCESS')
+        cacheResults('complete', [{"Blocks": []}], 'SUCCEEDED')
+        resultCache.flush()
+        self.assertIsNone(resultCache.get('partial'))
+        self.assertEqual(resultCache.get('complete'), [{"Blocks": []}])
+
+
+class JobApiTests(LocalBackendTestCase):
+    def test_submit_job_and_job_result(self):
+        submitted = self.post('/submit_job/', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT})
+        self.assertEqual(submitted.status_code, 202)
+        jobId = submitted.json()["jobId"]
+
+        result = self.client.get('/job_result/{}/?wait=1'.format(jobId))
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json()["status"], "SUCCEEDED")
+        self.assertEqual(len(result.json()["body"]["output_second"]), 3)
+        self.assertEqual(self.client.get('/job_result/unknown/').status_code, 404)
+
+    def test_wait_is_validated(self):
+        jobId = self.post('/submit_job/', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT}).json()["jobId"]
+        for wait in ('abc', 'nan'):
+            self.assertEqual(self.client.get('/job_result/{}/?wait={}'.format(jobId, wait)).status_code, 400)
+        self.assertEqual(self.client.get('/job_result/{}/?wait='.format(jobId)).status_code, 200)
+
+    @override_settings(TEXTRACT_LOCAL_BACKEND={'latency': 3600})
+    def test_job_result_while_running(self):
+        jobId = self.post('/submit_job/', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT}).json()["jobId"]
+        result = self.client.get('/job_result/{}/?wait=-1'.format(jobId))
+        self.assertEqual(result.status_code, 202)
+        self.assertEqual(result.json()["status"], "IN_PROGRESS")
+
+
+class TemplateTests(LocalBackendTestCase):
+    def test_templates(self):
+        created = self.post('/templates/', {"name": "jade", "inputFormat": INPUT_FORMAT})
+        self.assertEqual(created.status_code, 200)
+        template = created.json()["body"]
+        self.assertEqual(self.post('/templates/', {"inputFormat": INPUT_FORMAT}).json()["body"]["id"], template["id"])
+        self.assertEqual(self.client.get('/templates/{}/'.format(template["hash"])).json()["body"]["name"], "jade")
+        self.assertEqual(self.client.get('/templates/999/').status_code, 404)
+
+        response = self.post('/lambda_handler/', {"name": "invoice.pdf", "template": template["id"]})
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_formats_are_rejected(self):
+        invalid = dict(INPUT_FORMAT, matchThreshold="high")
+        self.assertEqual(self.post('/templates/', {"inputFormat": invalid}).status_code, 400)
+        self.assertEqual(self.post('/templates/', {"inputFormat": {"input_second": []}}).status_code, 400)
+
+        self.assertEqual(self.post('/lambda_handler/', {"name": "invoice.pdf"}).status_code, 400)
+        response = self.post('/lambda_handler/', {"name": "invoice.pdf", "inputFormat": {"input_first": []}})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post('/submit_job/', {"name": "invoice.pdf", "inputFormat": invalid}).status_code, 400)
+        self.assertEqual(self.post('/lambda_handler/', {"name": "invoice.pdf", "template": "42"}).status_code, 404)
+
+    def test_missing_name_is_rejected(self):
+        for path in ('/lambda_handler/', '/submit_job/'):
+            for body in ({"inputFormat": INPUT_FORMAT}, {"name": 7, "inputFormat": INPUT_FORMAT}):
+                response = self.post(path, body)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["error"], "Missing name")
+
+
+class BatchRequestTests(LocalBackendTestCase):
+    def test_batch(self):
+        items = [{"name": "invoice.pdf", "inputFormat": INPUT_FORMAT}, {"name": "scan.pdf", "inputFormat": INPUT_FORMAT},
+                 {"name": "bad.pdf"}, {"inputFormat": INPUT_FORMAT}, "junk"]
+        response = self.post('/batch/', {"items": items, "concurrency": 2})
+        self.assertEqual(response.status_code, 200)
+        results = [json.loads(l) for l in b"".join(response.streaming_content).decode().splitlines()]
+        statuses = dict((r["index"], r["statusCode"]) for r in results)
+        self.assertEqual(statuses, {0: 200, 1: 200, 2: 400, 3: 400, 4: 400})
+
+        self.assertEqual(self.post('/batch/', {"items": items, "concurrency": "x"}).status_code, 400)
+        self.assertEqual(self.post('/batch/', {"items": {}}).status_code, 400)
+
+
+class TimingRequestTests(LocalBackendTestCase):
+    def test_debug_timings(self):
+        response = self.post('/lambda_handler/?debug=1', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT})
+        self.assertIn('parse;dur=', response['Server-Timing'])
+        debug = response.json()["debug"]
+        self.assertEqual(debug["counts"]["pages"], 2)
+        self.assertIn('polling', debug["stagesMs"])
+        self.assertNotIn('debug', self.post('/lambda_handler/', {"name": "invoice.pdf",
+                                                                "inputFormat": INPUT_FORMAT}).json())
+        self.assertIs(getTimings(), NULL_TIMINGS)
+
+    def test_timed_request_does_not_break_the_next_one(self):
+        self.post('/lambda_handler/', {"name": "other.pdf", "inputFormat": INPUT_FORMAT})
+        submitted = self.post('/submit_job/', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT})
+        self.assertEqual(submitted.status_code, 202)
+        self.assertIn('startJob;dur=', submitted['Server-Timing'])
+
+
+class MetricsRequestTests(LocalBackendTestCase):
+    def test_metrics(self):
+        self.post('/lambda_handler/', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT})
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('# TYPE textract_document_seconds histogram', text)
+        self.assertIn('textract_result_cache_requests_total{result="miss"}', text)
+        self.assertIn('textract_documents_in_flight 0', text)
+
+
+class ResultStreamTests(LocalBackendTestCase):
+    def setUp(self):
+        super().setUp()
+        # A handful of blocks per GetDocumentAnalysis response, so every document spans many
+        patcher = mock.patch.object(backends, 'MAX_RESULTS', 7)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def recordedBlocks(self):
+        with open(os.path.join(self.directory, 'recordings', 'invoice.pdf.json')) as f:
+            return json.load(f)["Blocks"]
+
+    def test_pages_are_handed_over_in_order(self):
+        jobId = startJob("textract-backup", "invoice.pdf")
+        responses = list(streamJobResults(jobId, window=1))
+        self.assertGreater(len(responses), 5)
+        self.assertTrue(all(len(response["Blocks"]) <= 7 for response in responses))
+        self.assertEqual([b for response in responses for b in response["Blocks"]], self.recordedBlocks())
+
+    def test_paginated_results_give_the_same_answer(self):
+        shutil.copy(os.path.join(self.directory, 'recordings', 'invoice.pdf.json'),
+                    os.path.join(self.directory, 'recordings', 'copy.pdf.json'))
+        paginated = self.post('/lambda_handler/?debug=1', {"name": "invoice.pdf", "inputFormat": INPUT_FORMAT}).json()
+        with mock.patch.object(backends, 'MAX_RESULTS', 1000):
+            single = self.post('/lambda_handler/?debug=1', {"name": "copy.pdf", "inputFormat": INPUT_FORMAT}).json()
+        self.assertGreater(paginated["debug"]["counts"]["responsePages"], 5)
+        self.assertEqual(single["debug"]["counts"]["responsePages"], 1)
+        self.assertEqual(paginated["body"], single["body"])
+
+    def test_producer_errors_reach_the_consumer(self):
+        jobId = startJob("textract-backup", "invoice.pdf")
+        getDocumentAnalysis = backends.LocalTextractClient.get_document_analysis
+        calls = []
+
+        def failing(client, **kwargs):
+            calls.append(kwargs)
+            if(len(calls) == 3):
+                raise ClientError({'Error': {'Code': 'InternalServerError', 'Message': 'boom'}}, 'GetDocumentAnalysis')
+            return getDocumentAnalysis(client, **kwargs)
+
+        received = []
+        with mock.patch.object(backends.LocalTextractClient, 'get_document_analysis', failing):
+            with self.assertRaises(ClientError):
+                for response in streamJobResults(jobId, window=1):
+                    received.append(response)
+        self.assertEqual(len(received), 2)
+
+    def test_producer_stops_when_the_consumer_does(self):
+        jobId = startJob("textract-backup", "invoice.pdf")
+        responses = streamJobResults(jobId, window=1)
+        next(responses)
+        producer = [t for t in threading.enumerate() if t.name == "textract-results-{}".format(jobId)][0]
+        responses.close()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
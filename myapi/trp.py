@@ -1,6 +1,17 @@
+import bisect
 import json
+import math
+import re
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class BoundingBox:
+    __slots__ = ('_width', '_height', '_left', '_top')
+
     def __init__(self, width, height, left, top):
         self._width = width
         self._height = height
@@ -27,6 +38,8 @@ class BoundingBox:
         return self._top
 
 class Polygon:
+    __slots__ = ('_x', '_y')
+
     def __init__(self, x, y):
         self._x = x
         self._y = y
@@ -43,6 +56,8 @@ class Polygon:
         return self._y
 
 class Geometry:
+    __slots__ = ('_boundingBox', '_polygon')
+
     def __init__(self, geometry):
         boundingBox = geometry["BoundingBox"]
         polygon = geometry["Polygon"]
@@ -66,11 +81,290 @@ class Geometry:
     def polygon(self):
         return self._polygon
 
+BOX_LEFT = 0
+BOX_TOP = 1
+BOX_WIDTH = 2
+BOX_HEIGHT = 3
+
+class GeometryStore:
+    # Bounding boxes and polygon points of every block on a page, kept column-wise in flat
+    # arrays indexed by block. Blocks get lightweight views into it instead of their own
+    # BoundingBox and Polygon objects, and bulk queries run over whole columns at once.
+
+    def __init__(self, blocks):
+        self._ids = []
+        self._blockTypes = []
+        self._rows = {}
+        self._boxes = array('d')
+        self._points = array('d')
+        self._pointOffsets = array('l', [0])
+
+        for block in blocks:
+            if('Geometry' not in block or 'Id' not in block):
+                continue
+            geometry = block['Geometry']
+            boundingBox = geometry["BoundingBox"]
+            self._rows[block['Id']] = len(self._ids)
+            self._ids.append(block['Id'])
+            self._blockTypes.append(block.get('BlockType'))
+            self._boxes.extend((boundingBox["Left"], boundingBox["Top"], boundingBox["Width"], boundingBox["Height"]))
+            for pg in geometry.get("Polygon", ()):
+                self._points.extend((pg["X"], pg["Y"]))
+            self._pointOffsets.append(len(self._points) // 2)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, blockId):
+        return blockId in self._rows
+
+    def getRow(self, blockId):
+        return self._rows.get(blockId)
+
+    def getGeometry(self, blockId):
+        return GeometryView(self, self._rows[blockId])
+
+    def getBox(self, row):
+        i = row * 4
+        return self._boxes[i], self._boxes[i + 1], self._boxes[i + 2], self._boxes[i + 3]
+
+    def getPolygon(self, row):
+        start = self._pointOffsets[row] * 2
+        end = self._pointOffsets[row + 1] * 2
+        points = self._points
+        return [Polygon(points[i], points[i + 1]) for i in range(start, end, 2)]
+
+    def getIdsInRegion(self, left, top, right, bottom, contained=True):
+        # Blocks whose box lies inside (contained=True) or intersects the given rectangle
+        if(numpy is not None):
+            boxes = self.boxes
+            lefts = boxes[:, BOX_LEFT]
+            tops = boxes[:, BOX_TOP]
+            rights = lefts + boxes[:, BOX_WIDTH]
+            bottoms = tops + boxes[:, BOX_HEIGHT]
+            if(contained):
+                mask = (lefts >= left) & (tops >= top) & (rights <= right) & (bottoms <= bottom)
+            else:
+                mask = (lefts <= right) & (tops <= bottom) & (rights >= left) & (bottoms >= top)
+            return [self._ids[row] for row in numpy.flatnonzero(mask)]
+
+        ids = []
+        for row in range(len(self._ids)):
+            l, t, w, h = self.getBox(row)
+            if(contained):
+                inside = l >= left and t >= top and l + w <= right and t + h <= bottom
+            else:
+                inside = l <= right and t <= bottom and l + w >= left and t + h >= top
+            if(inside):
+                ids.append(self._ids[row])
+        return ids
+
+    @property
+    def ids(self):
+        return self._ids
+
+    @property
+    def blockTypes(self):
+        return self._blockTypes
+
+    @property
+    def boxes(self):
+        # An (n, 4) array of left, top, width, height sharing memory with the store when
+        # numpy is available, the flat array otherwise
+        if(numpy is not None):
+            return numpy.frombuffer(self._boxes, dtype=numpy.float64).reshape(-1, 4)
+        return self._boxes
+
+    @property
+    def points(self):
+        if(numpy is not None):
+            return numpy.frombuffer(self._points, dtype=numpy.float64).reshape(-1, 2)
+        return self._points
+
+    @property
+    def pointOffsets(self):
+        return self._pointOffsets
+
+class SpatialIndex:
+    # Uniform grid over the page (Textract coordinates are normalized to 0..1). Every block
+    # is registered in each cell its bounding box touches, so region and nearest-neighbour
+    # queries only look at the blocks of the cells around the query. The PAGE block covers
+    # the whole page and is left out.
+
+    def __init__(self, store, cellsPerSide=None):
+        self._store = store
+        if(cellsPerSide is None):
+            cellsPerSide = min(64, max(1, int(math.sqrt(len(store)))))
+        self._size = cellsPerSide
+        self._cells = [[] for _ in range(cellsPerSide * cellsPerSide)]
+
+        for row in range(len(store)):
+            if(store.blockTypes[row] == "PAGE"):
+                continue
+            left, top, width, height = store.getBox(row)
+            x0, y0 = self._cell(left, top)
+            x1, y1 = self._cell(left + width, top + height)
+            for cy in range(y0, y1 + 1):
+                for cx in range(x0, x1 + 1):
+                    self._cells[cy * cellsPerSide + cx].append(row)
+
+    def _cell(self, x, y):
+        last = self._size - 1
+        cx = min(last, max(0, int(x * self._size)))
+        cy = min(last, max(0, int(y * self._size)))
+        return cx, cy
+
+    def _rowsInCells(self, x0, y0, x1, y1):
+        rows = set()
+        for cy in range(y0, y1 + 1):
+            for cx in range(x0, x1 + 1):
+                rows.update(self._cells[cy * self._size + cx])
+        return rows
+
+    def _accept(self, row, blockTypes):
+        return blockTypes is None or self._store.blockTypes[row] in blockTypes
+
+    def _queryRows(self, left, top, right, bottom, contained, blockTypes):
+        x0, y0 = self._cell(left, top)
+        x1, y1 = self._cell(right, bottom)
+        rows = []
+        for row in self._rowsInCells(x0, y0, x1, y1):
+            if(not self._accept(row, blockTypes)):
+                continue
+            l, t, w, h = self._store.getBox(row)
+            if(contained):
+                inside = l >= left and t >= top and l + w <= right and t + h <= bottom
+            else:
+                inside = l <= right and t <= bottom and l + w >= left and t + h >= top
+            if(inside):
+                rows.append(row)
+        rows.sort()
+        return rows
+
+    def getIdsInRegion(self, left, top, right, bottom, blockTypes=None):
+        ids = self._store.ids
+        return [ids[row] for row in self._queryRows(left, top, right, bottom, True, blockTypes)]
+
+    def getIdsIntersecting(self, left, top, right, bottom, blockTypes=None):
+        ids = self._store.ids
+        return [ids[row] for row in self._queryRows(left, top, right, bottom, False, blockTypes)]
+
+    def _distance(self, row, x, y):
+        l, t, w, h = self._store.getBox(row)
+        dx = max(l - x, 0.0, x - (l + w))
+        dy = max(t - y, 0.0, y - (t + h))
+        return math.sqrt(dx * dx + dy * dy)
+
+    def getNearestIds(self, x, y, k=1, blockTypes=None, exclude=()):
+        # Searches rings of cells around the point. Once k candidates are closer than anything
+        # outside the rings searched so far could be, the remaining cells are skipped.
+        cx, cy = self._cell(x, y)
+        cellSize = 1.0 / self._size
+        seen = set()
+        found = []
+        for ring in range(self._size):
+            x0, y0 = max(0, cx - ring), max(0, cy - ring)
+            x1, y1 = min(self._size - 1, cx + ring), min(self._size - 1, cy + ring)
+            for gy in range(y0, y1 + 1):
+                for gx in range(x0, x1 + 1):
+                    if(ring and x0 < gx < x1 and y0 < gy < y1):
+                        continue
+                    for row in self._cells[gy * self._size + gx]:
+                        if(row in seen):
+                            continue
+                        seen.add(row)
+                        if(self._accept(row, blockTypes) and self._store.ids[row] not in exclude):
+                            found.append((self._distance(row, x, y), row))
+
+            reach = ring * cellSize + min(x - cx * cellSize, (cx + 1) * cellSize - x,
+                                          y - cy * cellSize, (cy + 1) * cellSize - y)
+            if(len(found) >= k):
+                found.sort()
+                if(found[k - 1][0] <= reach):
+                    break
+        found.sort()
+        return [self._store.ids[row] for _, row in found[:k]]
+
+    def getIdsRightOf(self, blockId, k=1, blockTypes=None):
+        # Blocks starting to the right of the given one and overlapping it vertically,
+        # closest first - e.g. the value printed next to a key on a fixed layout
+        row = self._store.getRow(blockId)
+        if(row is None):
+            return []
+        left, top, width, height = self._store.getBox(row)
+        right = left + width
+        candidates = []
+        for other in self._queryRows(right, top, 1.0, top + height, False, blockTypes):
+            l, t, w, h = self._store.getBox(other)
+            if(other != row and l >= right - width * 0.05):
+                candidates.append((l - right, other))
+        candidates.sort()
+        return [self._store.ids[other] for _, other in candidates[:k]]
+
+    @property
+    def store(self):
+        return self._store
+
+class BoundingBoxView:
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __str__(self):
+        return "width: {}, height: {}, left: {}, top: {}".format(self.width, self.height, self.left, self.top)
+
+    @property
+    def width(self):
+        return self._store._boxes[self._row * 4 + BOX_WIDTH]
+
+    @property
+    def height(self):
+        return self._store._boxes[self._row * 4 + BOX_HEIGHT]
+
+    @property
+    def left(self):
+        return self._store._boxes[self._row * 4 + BOX_LEFT]
+
+    @property
+    def top(self):
+        return self._store._boxes[self._row * 4 + BOX_TOP]
+
+class GeometryView:
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __str__(self):
+        s = "BoundingBox: {}\n".format(str(self.boundingBox))
+        return s
+
+    @property
+    def boundingBox(self):
+        return BoundingBoxView(self._store, self._row)
+
+    @property
+    def polygon(self):
+        return self._store.getPolygon(self._row)
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def row(self):
+        return self._row
+
 class Word:
+    __slots__ = ('_block', '_confidence', '_geometry', '_id', '_text')
+
     def __init__(self, block, blockMap):
         self._block = block
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = getBlockGeometry(blockMap, block)
         self._id = block['Id']
         self._text = ""
         if(block['Text']):
@@ -100,11 +394,13 @@ class Word:
         return self._block
 
 class Line:
+    __slots__ = ('_block', '_confidence', '_geometry', '_id', '_text', '_words')
+
     def __init__(self, block, blockMap):
 
         self._block = block
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = getBlockGeometry(blockMap, block)
         self._id = block['Id']
 
         self._text = ""
@@ -117,14 +413,16 @@ class Line:
                 if(rs['Type'] == 'CHILD'):
                     for cid in rs['Ids']:
                         if(blockMap[cid]["BlockType"] == "WORD"):
-                            self._words.append(Word(blockMap[cid], blockMap))
+                            self._words.append(getBlockObject(blockMap, cid, Word))
     def __str__(self):
-        s = "Line\n==========\n"
-        s = s + self._text + "\n"
-        s = s + "Words\n----------\n"
+        return "".join(self.iterRender())
+
+    def iterRender(self):
+        yield "Line\n==========\n"
+        yield self._text + "\n"
+        yield "Words\n----------\n"
         for word in self._words:
-            s = s + "[{}]".format(str(word))
-        return s
+            yield "[{}]".format(str(word))
 
     @property
     def confidence(self):
@@ -151,9 +449,11 @@ class Line:
         return self._block
 
 class SelectionElement:
+    __slots__ = ('_confidence', '_geometry', '_id', '_selectionStatus')
+
     def __init__(self, block, blockMap):
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = getBlockGeometry(blockMap, block)
         self._id = block['Id']
         self._selectionStatus = block['SelectionStatus']
 
@@ -173,11 +473,47 @@ class SelectionElement:
     def selectionStatus(self):
         return self._selectionStatus
 
+class BlockMap(dict):
+    # Raw blocks by Id, plus the objects built for WORD and SELECTION_ELEMENT blocks, so a
+    # word shared by a line, a key and a table cell is materialized once for all of them
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._objects = {}
+        self._geometryStores = {}
+
+    def addGeometryStore(self, store):
+        for blockId in store.ids:
+            self._geometryStores[blockId] = store
+
+    def getGeometryStore(self, blockId):
+        return self._geometryStores.get(blockId)
+
+    def getObject(self, blockId, cls):
+        obj = self._objects.get(blockId)
+        if(obj is None):
+            obj = cls(self[blockId], self)
+            self._objects[blockId] = obj
+        return obj
+
+def getBlockGeometry(blockMap, block):
+    if(isinstance(blockMap, BlockMap)):
+        store = blockMap.getGeometryStore(block['Id'])
+        if(store is not None):
+            return store.getGeometry(block['Id'])
+    return Geometry(block['Geometry'])
+
+def getBlockObject(blockMap, blockId, cls):
+    if(isinstance(blockMap, BlockMap)):
+        return blockMap.getObject(blockId, cls)
+    return cls(blockMap[blockId], blockMap)
+
 class FieldKey:
+    __slots__ = ('_block', '_confidence', '_geometry', '_id', '_text', '_content')
+
     def __init__(self, block, children, blockMap):
         self._block = block
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = getBlockGeometry(blockMap, block)
         self._id = block['Id']
         self._text = ""
         self._content = []
@@ -187,7 +523,7 @@ class FieldKey:
         for eid in children:
             wb = blockMap[eid]
             if(wb['BlockType'] == "WORD"):
-                w = Word(wb, blockMap)
+                w = getBlockObject(blockMap, eid, Word)
                 self._content.append(w)
                 t.append(w.text)
 
@@ -222,10 +558,12 @@ class FieldKey:
         return self._block
 
 class FieldValue:
+    __slots__ = ('_block', '_confidence', '_geometry', '_id', '_text', '_content')
+
     def __init__(self, block, children, blockMap):
         self._block = block
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = getBlockGeometry(blockMap, block)
         self._id = block['Id']
         self._text = ""
         self._content = []
@@ -235,11 +573,11 @@ class FieldValue:
         for eid in children:
             wb = blockMap[eid]
             if(wb['BlockType'] == "WORD"):
-                w = Word(wb, blockMap)
+                w = getBlockObject(blockMap, eid, Word)
                 self._content.append(w)
                 t.append(w.text)
             elif(wb['BlockType'] == "SELECTION_ELEMENT"):
-                se = SelectionElement(wb, blockMap)
+                se = getBlockObject(blockMap, eid, SelectionElement)
                 self._content.append(se)
                 self._text = se.selectionStatus
 
@@ -297,8 +635,7 @@ class Field:
             k = str(self._key)
         if(self._value):
             v = str(self._value)
-        s = s + "Key: {}\nValue: {}".format(k, v)
-        return s
+        return s + "Key: {}\nValue: {}".format(k, v)
 
     @property
     def key(self):
@@ -308,20 +645,34 @@ class Field:
     def value(self):
         return self._value
 
+_punctuation = re.compile(r'[^\w\s]+')
+_whitespace = re.compile(r'\s+')
+
+def normalizeKey(text):
+    # Case-folded, punctuation dropped and whitespace collapsed: "Invoice  No.:" -> "invoice no"
+    return _whitespace.sub(' ', _punctuation.sub(' ', text.casefold())).strip()
+
 class Form:
     def __init__(self):
         self._fields = []
         self._fieldsMap = {}
+        self._normalizedMap = {}
+        self._sortedKeys = None
+        self._sortedSuffixes = None
 
     def addField(self, field):
         self._fields.append(field)
         self._fieldsMap[field.key.text] = field
+        self._normalizedMap.setdefault(normalizeKey(field.key.text), []).append(len(self._fields) - 1)
+        self._sortedKeys = None
+        self._sortedSuffixes = None
 
     def __str__(self):
-        s = ""
+        return "".join(self.iterRender())
+
+    def iterRender(self):
         for field in self._fields:
-            s = s + str(field) + "\n"
-        return s
+            yield str(field) + "\n"
 
     @property
     def fields(self):
@@ -333,15 +684,53 @@ class Form:
             field = self._fieldsMap[key]
         return field
     
+    def getFieldsByNormalizedKey(self, key):
+        return [self._fields[i] for i in self._normalizedMap.get(normalizeKey(key), [])]
+
+    def getFieldByNormalizedKey(self, key):
+        indexes = self._normalizedMap.get(normalizeKey(key))
+        if(indexes):
+            return self._fields[indexes[0]]
+        return None
+
+    def _getSortedKeys(self):
+        if(self._sortedKeys is None):
+            self._sortedKeys = sorted(self._normalizedMap)
+        return self._sortedKeys
+
+    def _getSortedSuffixes(self):
+        # Every suffix of every normalized key, so "contains" becomes a prefix search over them
+        if(self._sortedSuffixes is None):
+            suffixes = set()
+            for key in self._normalizedMap:
+                for i in range(len(key)):
+                    suffixes.add((key[i:], key))
+            self._sortedSuffixes = sorted(suffixes)
+        return self._sortedSuffixes
+
+    def _fieldsForKeys(self, keys):
+        indexes = set()
+        for key in keys:
+            indexes.update(self._normalizedMap[key])
+        return [self._fields[i] for i in sorted(indexes)]
+
+    def searchFieldsByPrefix(self, prefix):
+        prefix = normalizeKey(prefix)
+        keys = self._getSortedKeys()
+        keys = keys[bisect.bisect_left(keys, prefix):bisect.bisect_left(keys, prefix + '\uffff')]
+        return self._fieldsForKeys(keys)
+
     def searchFieldsByKey(self, key):
-        searchKey = key.lower()
-        results = []
-        for field in self._fields:
-            if(field.key and searchKey in field.key.text.lower()):
-                results.append(field)
-        return results
+        searchKey = normalizeKey(key)
+        if(not searchKey):
+            return list(self._fields)
+        suffixes = self._getSortedSuffixes()
+        start = bisect.bisect_left(suffixes, (searchKey,))
+        end = bisect.bisect_left(suffixes, (searchKey + '\uffff',))
+        return self._fieldsForKeys(set(key for _, key in suffixes[start:end]))
 
 class Cell:
+    __slots__ = ('_block', '_confidence', '_rowIndex', '_columnIndex', '_rowSpan', '_columnSpan', '_geometry', '_id', '_content', '_text')
 
     def __init__(self, block, blockMap):
         self._block = block
@@ -350,23 +739,24 @@ class Cell:
         self._columnIndex = block['ColumnIndex']
         self._rowSpan = block['RowSpan']
         self._columnSpan = block['ColumnSpan']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = getBlockGeometry(blockMap, block)
         self._id = block['Id']
         self._content = []
-        self._text = ""
+        t = []
         if('Relationships' in block and block['Relationships']):
             for rs in block['Relationships']:
                 if(rs['Type'] == 'CHILD'):
                     for cid in rs['Ids']:
                         blockType = blockMap[cid]["BlockType"]
                         if(blockType == "WORD"):
-                            w = Word(blockMap[cid], blockMap)
+                            w = getBlockObject(blockMap, cid, Word)
                             self._content.append(w)
-                            self._text = self._text + w.text + ' '
+                            t.append(w.text + ' ')
                         elif(blockType == "SELECTION_ELEMENT"):
-                            se = SelectionElement(blockMap[cid], blockMap)
+                            se = getBlockObject(blockMap, cid, SelectionElement)
                             self._content.append(se)
-                            self._text = self._text + se.selectionStatus + ', '
+                            t.append(se.selectionStatus + ', ')
+        self._text = "".join(t)
 
     def __str__(self):
         return self._text
@@ -416,10 +806,11 @@ class Row:
         self._cells = []
 
     def __str__(self):
-        s = ""
+        return "".join(self.iterRender())
+
+    def iterRender(self):
         for cell in self._cells:
-            s = s + "[{}]".format(str(cell))
-        return s
+            yield "[{}]".format(str(cell))
 
     @property
     def cells(self):
@@ -432,10 +823,13 @@ class Table:
         self._block = block
 
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = getBlockGeometry(blockMap, block)
 
         self._id = block['Id']
         self._rows = []
+        self._cells = []
+        self._grid = None
+        self._headerMap = None
 
         ri = 1
         row = Row()
@@ -445,6 +839,7 @@ class Table:
                 if(rs['Type'] == 'CHILD'):
                     for cid in rs['Ids']:
                         cell = Cell(blockMap[cid], blockMap)
+                        self._cells.append(cell)
                         if(cell.rowIndex > ri):
                             self._rows.append(row)
                             row = Row()
@@ -454,11 +849,61 @@ class Table:
                         self._rows.append(row)
 
     def __str__(self):
-        s = "Table\n==========\n"
+        return "".join(self.iterRender())
+
+    def iterRender(self):
+        yield "Table\n==========\n"
         for row in self._rows:
-            s = s + "Row\n==========\n"
-            s = s + str(row) + "\n"
-        return s
+            yield "Row\n==========\n"
+            for s in row.iterRender():
+                yield s
+            yield "\n"
+
+    def _getGrid(self):
+        # rows x columns, 0-based, every position covered by a merged cell points at that cell
+        if(self._grid is None):
+            rowCount = 0
+            columnCount = 0
+            for cell in self._cells:
+                rowCount = max(rowCount, cell.rowIndex + max(cell.rowSpan, 1) - 1)
+                columnCount = max(columnCount, cell.columnIndex + max(cell.columnSpan, 1) - 1)
+
+            grid = [[None] * columnCount for _ in range(rowCount)]
+            for cell in self._cells:
+                for r in range(cell.rowIndex - 1, cell.rowIndex - 1 + max(cell.rowSpan, 1)):
+                    gridRow = grid[r]
+                    for c in range(cell.columnIndex - 1, cell.columnIndex - 1 + max(cell.columnSpan, 1)):
+                        if(gridRow[c] is None):
+                            gridRow[c] = cell
+            self._grid = grid
+        return self._grid
+
+    def getCell(self, row, column):
+        grid = self._getGrid()
+        if(0 <= row < len(grid) and 0 <= column < len(grid[row])):
+            return grid[row][column]
+        return None
+
+    def getColumnIndex(self, header):
+        # Normalized header text of the first row -> column, the leftmost column wins on repeats
+        if(self._headerMap is None):
+            self._headerMap = {}
+            grid = self._getGrid()
+            if(grid):
+                for c, cell in enumerate(grid[0]):
+                    if(cell is not None):
+                        self._headerMap.setdefault(normalizeKey(cell.text), c)
+        return self._headerMap.get(normalizeKey(header))
+
+    def getColumn(self, column, includeHeader=False):
+        # A column by index or header text, one cell (or None) per row
+        if(not isinstance(column, int)):
+            column = self.getColumnIndex(column)
+            if(column is None):
+                return []
+        grid = self._getGrid()
+        start = 0 if includeHeader else 1
+        return [row[column] if column < len(row) else None for row in grid[start:]]
 
     @property
     def confidence(self):
@@ -476,81 +921,171 @@ class Table:
     def rows(self):
         return self._rows
 
+    @property
+    def cells(self):
+        return self._cells
+
+    @property
+    def grid(self):
+        return self._getGrid()
+
+    @property
+    def rowCount(self):
+        return len(self._getGrid())
+
+    @property
+    def columnCount(self):
+        grid = self._getGrid()
+        return len(grid[0]) if grid else 0
+
+    @property
+    def headers(self):
+        grid = self._getGrid()
+        return [cell.text.strip() if cell is not None else "" for cell in grid[0]] if grid else []
+
     @property
     def block(self):
         return self._block
 
+PAGE_BLOCK_TYPES = frozenset(["PAGE", "LINE", "TABLE", "KEY_VALUE_SET"])
+
 class Page:
 
-    def __init__(self, blocks, blockMap):
+    def __init__(self, blocks, blockMap, lazy=False):
         self._blocks = blocks
-        self._text = ""
+        self._text = None
+        self._textParts = []
         self._lines = []
         self._form = Form()
         self._tables = []
-        self._content = []
-
-        self._parse(blockMap)
+        self._content = None
+        self._contentItems = []
+        self._geometry = None
+        self._id = None
+        self._geometryStore = None
+        self._spatialIndex = None
+        self._blocksById = None
+
+        # In lazy mode each kind of block (lines, form, tables) is only parsed the first
+        # time one of the properties that need it is read
+        self._blockMap = blockMap
+        self._pending = set(PAGE_BLOCK_TYPES)
+        if(not lazy):
+            self._parse()
 
     def __str__(self):
-        s = "Page\n==========\n"
-        for item in self._content:
-            s = s + str(item) + "\n"
-        return s
-
-    def _parse(self, blockMap):
-        for item in self._blocks:
+        return "".join(self.iterRender())
+
+    def iterRender(self):
+        yield "Page\n==========\n"
+        for item in self.content:
+            if(hasattr(item, 'iterRender')):
+                for s in item.iterRender():
+                    yield s
+            else:
+                yield str(item)
+            yield "\n"
+
+    def iterText(self):
+        self._parse(["LINE"])
+        for line in self._lines:
+            yield line.text + '\n'
+
+    def _parse(self, blockTypes=PAGE_BLOCK_TYPES):
+        blockTypes = self._pending.intersection(blockTypes)
+        if(not blockTypes):
+            return
+        blockMap = self._blockMap
+        if(isinstance(blockMap, BlockMap)):
+            self._getGeometryStore()
+
+        for position, item in enumerate(self._blocks):
+            if item["BlockType"] not in blockTypes:
+                continue
             if item["BlockType"] == "PAGE":
-                self._geometry = Geometry(item['Geometry'])
+                self._geometry = getBlockGeometry(blockMap, item)
                 self._id = item['Id']
             elif item["BlockType"] == "LINE":
                 l = Line(item, blockMap)
                 self._lines.append(l)
-                self._content.append(l)
-                self._text = self._text + l.text + '\n'
+                self._contentItems.append((position, l))
+                self._textParts.append(l.text + '\n')
             elif item["BlockType"] == "TABLE":
                 t = Table(item, blockMap)
                 self._tables.append(t)
-                self._content.append(t)
+                self._contentItems.append((position, t))
             elif item["BlockType"] == "KEY_VALUE_SET":
                 if 'KEY' in item['EntityTypes']:
                     f = Field(item, blockMap)
                     if(f.key):
                         self._form.addField(f)
-                        self._content.append(f)
+                        self._contentItems.append((position, f))
                     else:
                         print("WARNING: Detected K/V where key does not have content. Excluding key from output.")
                         print(f)
                         print(item)
 
-    def getLinesInReadingOrder(self):
+        self._pending.difference_update(blockTypes)
+        if(not self._pending):
+            self._blockMap = None
+
+    def _getGeometryStore(self):
+        if(self._geometryStore is None):
+            self._geometryStore = GeometryStore(self._blocks)
+            if(isinstance(self._blockMap, BlockMap)):
+                self._blockMap.addGeometryStore(self._geometryStore)
+        return self._geometryStore
+
+    def _getBlocks(self, ids):
+        if(self._blocksById is None):
+            self._blocksById = dict((block['Id'], block) for block in self._blocks if 'Id' in block)
+        return [self._blocksById[blockId] for blockId in ids]
+
+    def getBlocksInRegion(self, left, top, right, bottom, blockTypes=None):
+        return self._getBlocks(self.spatialIndex.getIdsInRegion(left, top, right, bottom, blockTypes))
+
+    def getBlocksIntersecting(self, left, top, right, bottom, blockTypes=None):
+        return self._getBlocks(self.spatialIndex.getIdsIntersecting(left, top, right, bottom, blockTypes))
+
+    def getNearestBlocks(self, x, y, k=1, blockTypes=("LINE", "WORD")):
+        return self._getBlocks(self.spatialIndex.getNearestIds(x, y, k, blockTypes))
+
+    def getBlocksRightOf(self, item, k=1, blockTypes=("LINE", "WORD")):
+        return self._getBlocks(self.spatialIndex.getIdsRightOf(item.id, k, blockTypes))
+
+    def getLinesInReadingOrder(self, maxColumnWidth=0.5):
+        # Columns are the union of the x-intervals of the lines, found with one sweep over the
+        # intervals sorted by their left edge. Lines wider than maxColumnWidth (titles, footers)
+        # would bridge the gutters, so they are left out of the sweep.
+        boxes = [line.geometry.boundingBox for line in self.lines]
+        intervals = sorted((bb.left, bb.left + bb.width) for bb in boxes if bb.width <= maxColumnWidth)
         columns = []
-        lines = []
-        for item in self._lines:
-                column_found=False
-                for index, column in enumerate(columns):
-                    bbox_left = item.geometry.boundingBox.left
-                    bbox_right = item.geometry.boundingBox.left + item.geometry.boundingBox.width
-                    bbox_centre = item.geometry.boundingBox.left + item.geometry.boundingBox.width/2
-                    column_centre = column['left'] + column['right']/2
-                    if (bbox_centre > column['left'] and bbox_centre < column['right']) or (column_centre > bbox_left and column_centre < bbox_right):
-                        #Bbox appears inside the column
-                        lines.append([index, item.text])
-                        column_found=True
-                        break
-                if not column_found:
-                    columns.append({'left':item.geometry.boundingBox.left, 'right':item.geometry.boundingBox.left + item.geometry.boundingBox.width})
-                    lines.append([len(columns)-1, item.text])
-
-        lines.sort(key=lambda x: x[0])
-        return lines
+        for left, right in intervals:
+            if(columns and left < columns[-1][1]):
+                columns[-1][1] = max(columns[-1][1], right)
+            else:
+                columns.append([left, right])
+        starts = [column[0] for column in columns]
+
+        # Wide lines cut the page into horizontal bands and are read where they sit: each one
+        # opens the band below it. Within a band every line goes to the column its centre
+        # falls in, then top to bottom within the column.
+        wideTops = sorted(bb.top for bb in boxes if bb.width > maxColumnWidth)
+        ordered = []
+        for position, (line, bb) in enumerate(zip(self.lines, boxes)):
+            if(bb.width > maxColumnWidth):
+                band = bisect.bisect_left(wideTops, bb.top) + 1
+                index = max(0, bisect.bisect_right(starts, bb.left) - 1)
+                ordered.append((band, 0, 0, bb.top, bb.left, position, index, line.text))
+            else:
+                band = bisect.bisect_right(wideTops, bb.top)
+                index = max(0, bisect.bisect_right(starts, bb.left + bb.width / 2) - 1)
+                ordered.append((band, 1, index, bb.top, bb.left, position, index, line.text))
+        ordered.sort()
+        return [[item[6], item[7]] for item in ordered]
 
     def getTextInReadingOrder(self):
-        lines = self.getLinesInReadingOrder()
-        text = ""
-        for line in lines:
-            text = text + line[1] + '\n'
-        return text
+        return "".join(line[1] + '\n' for line in self.getLinesInReadingOrder())
 
     @property
     def blocks(self):
@@ -558,80 +1093,173 @@ class Page:
 
     @property
     def text(self):
+        self._parse(["LINE"])
+        if(self._text is None):
+            self._text = "".join(self._textParts)
+            self._textParts = None
         return self._text
 
     @property
     def lines(self):
+        self._parse(["LINE"])
         return self._lines
 
     @property
     def form(self):
+        self._parse(["KEY_VALUE_SET"])
         return self._form
 
     @property
     def tables(self):
+        self._parse(["TABLE"])
         return self._tables
 
     @property
     def content(self):
+        if(self._content is None):
+            self._parse()
+            # Parsing kind by kind appends out of block order, the position restores it
+            self._contentItems.sort(key=lambda item: item[0])
+            self._content = [item for _, item in self._contentItems]
+            self._contentItems = None
         return self._content
 
     @property
     def geometry(self):
+        self._parse(["PAGE"])
         return self._geometry
 
+    @property
+    def geometryStore(self):
+        return self._getGeometryStore()
+
+    @property
+    def spatialIndex(self):
+        if(self._spatialIndex is None):
+            self._spatialIndex = SpatialIndex(self._getGeometryStore())
+        return self._spatialIndex
+
     @property
     def id(self):
+        self._parse(["PAGE"])
         return self._id
 
+def loadResponsePage(responsePage):
+    # A GetDocumentAnalysis response as a dict, a JSON string or bytes, or a file-like object
+    if(isinstance(responsePage, dict)):
+        return responsePage
+    if(hasattr(responsePage, 'read')):
+        return json.load(responsePage)
+    return json.loads(responsePage)
+
+def isSingleResponsePage(responsePages):
+    return isinstance(responsePages, (dict, str, bytes, bytearray)) or hasattr(responsePages, 'read')
+
+def splitDocumentPages(responsePages):
+    # Blocks come grouped by page, so a PAGE block closes the previous page and every page
+    # is yielded as soon as the block list that follows it starts the next one
+    documentPage = None
+    for page in responsePages:
+        for block in page['Blocks']:
+            if(block['BlockType'] == 'PAGE'):
+                if(documentPage):
+                    yield documentPage
+                documentPage = []
+                documentPage.append(block)
+            else:
+                documentPage.append(block)
+    if(documentPage):
+        yield documentPage
+
+class DocumentStream:
+    # Turns an iterator of response pages into parsed Pages one at a time. Each page gets a
+    # BlockMap of its own blocks only and the stream keeps nothing once a page is handed
+    # out, so memory stays flat however long the document is as long as the caller does
+    # not hold on to the pages either.
+
+    def __init__(self, responsePages, lazy=False):
+        if(isSingleResponsePage(responsePages)):
+            responsePages = [responsePages]
+        self._source = responsePages
+        self._lazy = lazy
+        self._pageCount = 0
+
+    def __iter__(self):
+        source, self._source = self._source, None
+        if(source is None):
+            raise ValueError("DocumentStream can only be iterated once")
+        for blocks in splitDocumentPages(loadResponsePage(page) for page in source):
+            blockMap = BlockMap()
+            for block in blocks:
+                if('Id' in block):
+                    blockMap[block['Id']] = block
+            self._pageCount += 1
+            yield Page(blocks, blockMap, self._lazy)
+
+    @property
+    def pageCount(self):
+        return self._pageCount
+
 class Document:
 
-    def __init__(self, responsePages):
+    def __init__(self, responsePages, lazy=False):
 
-        if(not isinstance(responsePages, list)):
+        if(isSingleResponsePage(responsePages)):
             rps = []
             rps.append(responsePages)
             responsePages = rps
 
-        self._responsePages = responsePages
+        # Anything other than a list (e.g. a generator still fetching NextToken pages) is
+        # consumed incrementally and each page is parsed as soon as all of its blocks arrived
+        self._source = responsePages
+        if(isinstance(responsePages, list)):
+            self._responsePages = responsePages
+        else:
+            self._responsePages = []
         self._pages = []
+        self._lazy = lazy
+        self._form = None
 
         self._parse()
 
     def __str__(self):
-        s = "\nDocument\n==========\n"
-        for p in self._pages:
-            s = s + str(p) + "\n\n"
-        return s
-
-    def _parseDocumentPagesAndBlockMap(self):
+        return "".join(self.iterRender())
 
-        blockMap = {}
+    def iterRender(self):
+        yield "\nDocument\n==========\n"
+        for p in self._pages:
+            for s in p.iterRender():
+                yield s
+            yield "\n\n"
 
-        documentPages = []
-        documentPage = None
-        for page in self._responsePages:
+    def iterText(self):
+        for p in self._pages:
+            for s in p.iterText():
+                yield s
+
+    def _iterResponsePages(self):
+        for page in self._source:
+            page = loadResponsePage(page)
+            if(self._responsePages is not self._source):
+                self._responsePages.append(page)
             for block in page['Blocks']:
                 if('BlockType' in block and 'Id' in block):
-                    blockMap[block['Id']] = block
+                    self._blockMap[block['Id']] = block
+            yield page
 
-                if(block['BlockType'] == 'PAGE'):
-                    if(documentPage):
-                        documentPages.append({"Blocks" : documentPage})
-                    documentPage = []
-                    documentPage.append(block)
-                else:
-                    documentPage.append(block)
-        if(documentPage):
-            documentPages.append({"Blocks" : documentPage})
-        return documentPages, blockMap
+    def _parseDocumentPagesAndBlockMap(self):
+        for documentPage in splitDocumentPages(self._iterResponsePages()):
+            yield {"Blocks" : documentPage}
 
     def _parse(self):
 
-        self._responseDocumentPages, self._blockMap = self._parseDocumentPagesAndBlockMap()
-        for documentPage in self._responseDocumentPages:
-            page = Page(documentPage["Blocks"], self._blockMap)
+        self._responseDocumentPages = []
+        self._blockMap = BlockMap()
+        for documentPage in self._parseDocumentPagesAndBlockMap():
+            self._responseDocumentPages.append(documentPage)
+            page = Page(documentPage["Blocks"], self._blockMap, self._lazy)
             self._pages.append(page)
+        self._source = None
 
     @property
     def blocks(self):
@@ -641,6 +1269,17 @@ class Document:
     def pageBlocks(self):
         return self._responseDocumentPages
 
+    @property
+    def form(self):
+        # All pages' fields in one index, in page order
+        if(self._form is None):
+            form = Form()
+            for page in self._pages:
+                for field in page.form.fields:
+                    form.addField(field)
+            self._form = form
+        return self._form
+
     @property
     def pages(self):
         return self._pages
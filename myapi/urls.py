@@ -3,5 +3,11 @@ from django.conf.urls import url, include
 from . import views
 
 urlpatterns = [
-    url(r'^lambda_handler/', views.lambda_handler)
+    url(r'^lambda_handler/', views.lambda_handler),
+    url(r'^metrics/', views.metrics),
+    url(r'^batch/', views.batch),
+    url(r'^submit_job/', views.submit_job),
+    url(r'^job_result/(?P<jobId>[\w-]+)/', views.job_result),
+    url(r'^templates/$', views.templates),
+    url(r'^templates/(?P<templateRef>\w+)/', views.template_detail)
 ]